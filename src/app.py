@@ -5,9 +5,15 @@ import os
 import plotly.express as px
 from generator import generate_clients
 from mapper import map_clients_to_portraits
-from visualization import plot_portrait_distribution, plot_heatmap_features, plot_metric
-from simulator_advanced import simulate_feature_response
+from visualization import (plot_portrait_distribution, plot_heatmap_features, plot_metric,
+                           plot_feature_distribution, build_portrait_summary, downsample)
 import predictor
+import incremental
+import instrumentation
+import preview_store
+import sensitivity
+import sketches
+import uplift
 
 st.set_page_config(
     page_title="АЗС TwinLab",
@@ -16,6 +22,73 @@ st.set_page_config(
     page_icon="⛽"
 )
 
+
+def keep_handle(key, handle):
+    """
+    Запомнить в сессии handle таблицы из хранилища (None — забыть),
+    прежняя таблица под этим ключом освобождается.
+    """
+    old = st.session_state.get(key)
+    if old is not None and old != handle:
+        preview_store.release(old)
+    if handle is None:
+        st.session_state.pop(key, None)
+    else:
+        st.session_state[key] = handle
+
+
+def keep_frame(key, df, name=None):
+    """
+    Положить таблицу в общее хранилище, в сессии оставить только handle.
+    """
+    keep_handle(key, preview_store.put(df, name=name))
+
+
+def show_preview(handle, key, page_size=preview_store.DEFAULT_PAGE_SIZE):
+    """
+    Постраничный просмотр таблицы из хранилища с выбором колонок.
+    """
+    meta = preview_store.info(handle)
+    pages = preview_store.n_pages(handle, page_size)
+    c1, c2 = st.columns([3, 1])
+    with c1:
+        columns = st.multiselect(
+            "Колонки", meta["columns"], default=meta["columns"], key=f"{key}_cols")
+    with c2:
+        page = st.number_input(
+            f"Страница (из {pages})", min_value=1, max_value=pages, value=1, key=f"{key}_page")
+    st.dataframe(preview_store.get_page(
+        handle, page - 1, page_size, columns))
+    st.caption(f"Всего строк: {meta['rows']}")
+
+
+def drop_simulation():
+    """
+    Забыть симуляцию сессии: она построена по прежним клиентам
+    (их client_id не совпадут с новыми, и прогноз обнулится).
+    """
+    handle = st.session_state.pop("sim_handle", None)
+    if handle is not None:
+        preview_store.release(handle)
+    for key in ("sim_metrics", "sim_feature", "sim_cache", "sim_changed", "forecast_cache",
+                "region_sketch"):
+        st.session_state.pop(key, None)
+
+
+def keep_forecast(clients_handle, portraits_forecast, feature_name):
+    """
+    Сохранить прогноз в сессию (клиенты — handle в хранилище, если есть) и в data/.
+    """
+    os.makedirs("data", exist_ok=True)
+    keep_handle("forecast_clients_handle", clients_handle)
+    if clients_handle is not None:
+        preview_store.get(clients_handle).to_csv(os.path.join(
+            "data", f"forecast_clients_{feature_name}.csv"), index=False)
+    st.session_state["forecast_portraits"] = portraits_forecast
+    portraits_forecast.to_csv(os.path.join(
+        "data", f"forecast_portraits_{feature_name}.csv"), index=False)
+
+
 # === заголовок ===
 st.title("⛽АЗС TwinLab⛽")
 st.subheader("Команда-разработчик: «404: Имя не найдено»")
@@ -37,11 +110,13 @@ num_clients = st.sidebar.slider(
 with st.sidebar:
     st.markdown(""" --- """)
 
-clients_df = st.session_state.get("clients_df", None)
 portraits_rules = json.load(
     open("src/behavior_rules.json", "r", encoding="utf-8"))
 feature_hypotheses = json.load(
     open("src/feature_hypotheses.json", "r", encoding="utf-8"))
+# версия справочников: по ней кэши симуляции и прогноза замечают правку JSON
+rules_version = (os.path.getmtime("src/behavior_rules.json"),
+                 os.path.getmtime("src/feature_hypotheses.json"))
 
 st.sidebar.header("⚙️Настройки симуляции")
 selected_feature = st.sidebar.selectbox(
@@ -59,7 +134,47 @@ feature_choice = st.sidebar.selectbox(
 )
 train_model = st.sidebar.checkbox(
     "Обучить модель на симуляциях (если есть данные)", value=True)
+use_uplift = st.sidebar.checkbox(
+    "Uplift-модель по Монте-Карло (обучается один раз на фичу)", value=False)
+clients_detail = st.sidebar.checkbox(
+    "Прогноз по каждому клиенту (медленнее)", value=False)
+
+with st.sidebar:
+    st.markdown(""" --- """)
 
+st.sidebar.header("⚙️Профилирование")
+profiling_on = st.sidebar.checkbox("Замерять стадии пайплайна", value=False)
+profiling_cprofile = st.sidebar.checkbox(
+    "Снимать cProfile (медленнее)", value=False, disabled=not profiling_on)
+# сборщик свой у каждой сессии; переключатель не влияет на другие сессии
+profiler = st.session_state.get("profiler")
+if profiling_on:
+    if profiler is None:
+        profiler = instrumentation.Collector(
+            track_memory=True, cprofile=profiling_cprofile)
+        st.session_state["profiler"] = profiler
+    else:
+        profiler.set_options(track_memory=True, cprofile=profiling_cprofile)
+    instrumentation.activate(profiler)
+else:
+    instrumentation.deactivate()
+    if profiler is not None:
+        profiler.close()
+        del st.session_state["profiler"]
+        profiler = None
+
+
+# таблицы давно закончившихся сессий хранилище удаляет по TTL;
+# если сессия простояла дольше — забываем устаревшие handle
+for key in ("clients_handle", "mapped_handle", "sim_handle", "forecast_clients_handle"):
+    if key in st.session_state and not preview_store.exists(st.session_state[key]):
+        del st.session_state[key]
+# кэши ссылаются на те же handle
+if "sim_handle" not in st.session_state:
+    st.session_state.pop("sim_cache", None)
+if "forecast_clients_handle" not in st.session_state and \
+        st.session_state.get("forecast_cache", {}).get("entry", {}).get("clients_handle"):
+    st.session_state.pop("forecast_cache", None)
 
 DATA_PATH = "data/synthetic.csv"
 MAPPED_PATH = "data/synthetic_mapped.csv"
@@ -76,7 +191,8 @@ with col1:
         if os.path.exists(DATA_PATH):
             try:
                 df = pd.read_csv(DATA_PATH)
-                st.session_state["clients_df"] = df
+                keep_frame("clients_handle", df, name=DATA_PATH)
+                drop_simulation()
                 st.success(f"Загружен {DATA_PATH} ({len(df)} строк)")
             except Exception as e:
                 st.error(f"Ошибка чтения {DATA_PATH}: {e}")
@@ -89,24 +205,29 @@ with col2:
         # сохраняем автоматически в data/
         os.makedirs("data", exist_ok=True)
         df.to_csv(DATA_PATH, index=False)
-        st.session_state["clients_df"] = df
+        keep_frame("clients_handle", df, name=DATA_PATH)
+        drop_simulation()
         st.success(
             f"Данные сгенерированы и сохранены в {DATA_PATH} ({len(df)} строк)")
 
 # если загрузил файл через drag&drop
+# (читаем только один раз на файл, а не на каждый rerun)
 if uploaded is not None:
-    try:
-        df_uploaded = pd.read_csv(uploaded)
-        st.session_state["clients_df"] = df_uploaded
-        st.success(
-            f"Загружен файл: {uploaded.name} ({len(df_uploaded)} строк)")
-    except Exception as e:
-        st.error(f"Не удалось прочитать загруженный файл: {e}")
+    upload_key = f"{uploaded.name}:{uploaded.size}"
+    if st.session_state.get("uploaded_key") != upload_key:
+        try:
+            df_uploaded = pd.read_csv(uploaded)
+            keep_frame("clients_handle", df_uploaded, name=uploaded.name)
+            drop_simulation()
+            st.session_state["uploaded_key"] = upload_key
+            st.success(
+                f"Загружен файл: {uploaded.name} ({len(df_uploaded)} строк)")
+        except Exception as e:
+            st.error(f"Не удалось прочитать загруженный файл: {e}")
 
 st.subheader("Превью данных")
-if "clients_df" in st.session_state:
-    df = st.session_state["clients_df"]
-    st.dataframe(df.head(10))
+if "clients_handle" in st.session_state:
+    show_preview(st.session_state["clients_handle"], "clients_preview", page_size=10)
 else:
     st.info("Нет данных. Загрузите CSV или сгенерируйте новый набор.")
 
@@ -126,7 +247,7 @@ with st.expander("Наши клиенты", expanded=False):
 
 # === маппинг ===
 st.subheader("Маппинг клиентов на портреты")
-if "clients_df" in st.session_state:
+if "clients_handle" in st.session_state:
     if st.button("Сопоставить с портретами"):
         with st.spinner("Анализ и кластеризация клиентов..."):
             try:
@@ -138,23 +259,29 @@ if "clients_df" in st.session_state:
 
             try:
                 mapped_df = map_clients_to_portraits(
-                    st.session_state["clients_df"], portraits)
+                    preview_store.get(st.session_state["clients_handle"]), portraits)
             except Exception as e:
                 st.error(f"Ошибка маппинга: {e}")
                 st.stop()
 
-            st.session_state["mapped_df"] = mapped_df
+            keep_frame("mapped_handle", mapped_df, name=MAPPED_PATH)
+            st.session_state.pop("portrait_summary", None)
+            # симуляция и кэш прогноза строились на прежнем маппинге
+            drop_simulation()
             # сохраняем результат
             os.makedirs("data", exist_ok=True)
             mapped_df.to_csv(MAPPED_PATH, index=False)
 
         st.success("✅ Маппинг завершен!")
-        st.dataframe(mapped_df.head(10))
+        st.markdown(f"Результат также сохранён в `{MAPPED_PATH}`")
+
+    if "mapped_handle" in st.session_state:
+        show_preview(st.session_state["mapped_handle"],
+                     "mapped_preview", page_size=10)
 
         st.markdown("### Распределение по портретам")
-        counts = mapped_df["portrait_name"].value_counts()
-        st.bar_chart(counts)
-        st.markdown(f"Результат также сохранён в `{MAPPED_PATH}`")
+        st.bar_chart(preview_store.value_counts(
+            st.session_state["mapped_handle"], "portrait_name"))
 else:
     st.info("Сначала загрузите или сгенерируйте данные.")
 
@@ -165,28 +292,72 @@ feature_names = {
     "avg_spend_per_visit": "Средний чек"
 }
 
-if "mapped_df" in st.session_state:
-    df_mapped = st.session_state["mapped_df"]
+if "mapped_handle" in st.session_state:
+    df_mapped = preview_store.get(st.session_state["mapped_handle"])
+    # сводка по портретам считается один раз на смапленный датасет
+    if "portrait_summary" not in st.session_state:
+        st.session_state["portrait_summary"] = build_portrait_summary(
+            df_mapped, list(feature_names.keys()))
+    portrait_summary = st.session_state["portrait_summary"]
 
     st.subheader("Визуализация портретов")
-    st.plotly_chart(plot_portrait_distribution(df_mapped))
+    st.plotly_chart(plot_portrait_distribution(
+        df_mapped, summary=portrait_summary))
 
     st.plotly_chart(plot_heatmap_features(
-        df_mapped, list(feature_names.keys()), feature_names))
+        df_mapped, list(feature_names.keys()), feature_names, summary=portrait_summary))
 
     st.subheader("Метрики по портретам")
     for metric, name in feature_names.items():
-        st.plotly_chart(plot_metric(df_mapped, metric, name))
+        st.plotly_chart(plot_metric(
+            df_mapped, metric, name, summary=portrait_summary))
+
+    dist_metric = st.selectbox(
+        "Распределение признака внутри портретов",
+        list(feature_names.keys()), format_func=lambda m: feature_names[m])
+    st.plotly_chart(plot_feature_distribution(
+        df_mapped, dist_metric, feature_names[dist_metric]))
 
 # === симуляцмя реакции портретов ===
 st.subheader("Симуляция реакции клиентов")
-if clients_df is not None and st.button("Запустить симуляцию"):
+mapped_handle = st.session_state.get("mapped_handle")
+if mapped_handle is not None and st.button("Запустить симуляцию"):
     with st.spinner("Симуляция отклика клиентов..."):
-        sim_df, metrics_df = simulate_feature_response(
-            clients_df, portraits_rules, feature_hypotheses, selected_feature)
-        st.session_state["sim_df"] = sim_df
+        entry = incremental.build_simulation_cache(
+            preview_store.get(mapped_handle), portraits_rules, feature_hypotheses, selected_feature)
+        # в сессии — только маленькая запись кэша, сама таблица в хранилище
+        st.session_state["sim_cache"] = {
+            "source": mapped_handle, "version": rules_version, "entry": entry}
+        keep_handle("sim_handle", entry["sim_handle"])
+        st.session_state["sim_metrics"] = entry["metrics"]
+        st.session_state["sim_feature"] = selected_feature
+        # прогноз строился на прежней симуляции — его нужно запустить заново
+        st.session_state.pop("forecast_cache", None)
+        st.session_state.pop("sim_changed", None)
 
     st.success("✅ Симуляция завершена!")
+elif "sim_handle" not in st.session_state:
+    st.info("Сначала выполните маппинг клиентов.")
+
+# правила или гипотезы поменялись — пересимулируем только затронутые портреты
+sim_cache = st.session_state.get("sim_cache")
+if sim_cache is not None and sim_cache["version"] != rules_version \
+        and sim_cache["source"] == mapped_handle:
+    with st.spinner("Справочники изменились — пересчёт симуляции..."):
+        entry, changed = incremental.update_simulation_cache(
+            sim_cache["entry"], preview_store.get(mapped_handle),
+            portraits_rules, feature_hypotheses)
+    sim_cache.update(entry=entry, version=rules_version)
+    if changed is None or changed:
+        keep_handle("sim_handle", entry["sim_handle"])
+        st.session_state["sim_metrics"] = entry["metrics"]
+        changed = set(entry["deps"]["portraits"]) if changed is None else changed
+        st.session_state["sim_changed"] = st.session_state.get(
+            "sim_changed", set()) | changed
+        st.info("Симуляция пересчитана для портретов: " + ", ".join(sorted(changed)))
+
+if "sim_handle" in st.session_state:
+    metrics_df = st.session_state["sim_metrics"]
 
     st.subheader("Метрики отклика по портретам")
     st.dataframe(metrics_df)
@@ -194,26 +365,58 @@ if clients_df is not None and st.button("Запустить симуляцию")
     st.subheader("Распределение откликов по портретам")
     st.bar_chart(metrics_df.set_index("portrait_name")["response_rate"])
 
-    st.subheader("Первые 200 клиентов с реакцией")
-    st.dataframe(sim_df.head(200))
-else:
-    st.info("Сначала выполните маппинг клиентов.")
+    st.subheader("Клиенты с реакцией")
+    show_preview(st.session_state["sim_handle"], "sim_preview")
+
+# === регионы × портреты по скетчам ===
+# прогноз по клиентам даёт изменение выручки, симуляция — долю откликов
+region_sources = [("forecast_clients_handle", "прогноз по клиентам"),
+                  ("sim_handle", "симуляция"), ("mapped_handle", "маппинг")]
+region_key, region_label = next(
+    ((k, label) for k, label in region_sources if k in st.session_state), (None, None))
+region_source = st.session_state.get(region_key) if region_key else None
+if region_source is not None:
+    with st.expander("Регионы × портреты (приближённые оценки)", expanded=False):
+        st.caption(f"Источник: {region_label}")
+        missing = sketches.missing_columns(preview_store.info(region_source)["columns"])
+        cached = st.session_state.get("region_sketch")
+        if missing:
+            st.info("Для оценок по регионам не хватает колонок: " + ", ".join(missing))
+        elif st.button("Построить оценки по регионам"):
+            # скетчи считаются только по запросу, а не на каждый rerun;
+            # отклик — по той фиче, которую симулировали, а не по текущему выбору
+            sim_feature = st.session_state.get("sim_feature")
+            sketch = sketches.build_region_sketch(
+                sketches.iter_chunks(preview_store.get(region_source)),
+                response_col=f"response_to_{sim_feature}" if sim_feature else None)
+            cached = (region_source, sketch)
+            st.session_state["region_sketch"] = cached
+        if not missing and cached is not None and cached[0] == region_source:
+            sketch = cached[1]
+            st.caption(
+                f"Состояние скетчей: {sketch.nbytes / 1024:.0f} КБ, "
+                f"различных клиентов ≈ {sketch.distinct_clients():,.0f}".replace(",", " "))
+            st.dataframe(sketch.region_table(top=50))
+            st.dataframe(sketch.portrait_table())
 
 # === прогноз поведения ===
 st.subheader("Прогнозирование поведения клиентов")
 
-# загрузка данных
+# данные сессии берём из общего хранилища (без чтения CSV на каждый rerun)
+mapped_df = None
+sim_df = None
+if "mapped_handle" in st.session_state:
+    mapped_df = preview_store.get(st.session_state["mapped_handle"])
+    if "sim_handle" in st.session_state:
+        sim_df = preview_store.get(st.session_state["sim_handle"])
+        if f"response_to_{feature_choice}" in sim_df.columns:
+            trained_on_sim = train_model and predictor.has_post_metrics(sim_df, feature_choice)
+            st.success("✅ Отклик клиентов берётся из симуляции" + (
+                ", модели обучаются на её post-метриках" if trained_on_sim else ""))
+else:
+    st.info("Сначала выполните маппинг клиентов.")
 
 try:
-    mapped_df = pd.read_csv("data/synthetic_mapped.csv")
-    st.success("✅ Загрузка клиентов после маппинга: synthetic_mapped.csv")
-
-    sim_df_path = "data/simulated_reactions_advanced.csv"
-    sim_df = pd.read_csv(sim_df_path) if os.path.exists(sim_df_path) else None
-    if sim_df is not None:
-        st.success(
-            "✅ Загружены данные симуляции: simulated_reactions_advanced.csv")
-
     with open("src/behavior_rules.json", "r", encoding="utf-8") as f:
         portraits_rules = json.load(f)
 
@@ -224,22 +427,52 @@ except Exception as e:
     st.error(f"Ошибка при загрузке данных: {e}")
     st.stop()
 
+# справочники или отклики симуляции поменялись — пересчитываем затронутые портреты
+forecast_cache = st.session_state.get("forecast_cache")
+sim_changed = st.session_state.pop("sim_changed", None)
+if forecast_cache is not None and forecast_cache["source"] == mapped_handle \
+        and (forecast_cache["version"] != rules_version or sim_changed):
+    with st.spinner("Справочники изменились — пересчёт прогноза..."):
+        entry, changed = incremental.update_forecast_cache(
+            forecast_cache["entry"], mapped_df, sim_df, portraits_rules, feature_hypotheses,
+            changed_by_simulation=sim_changed)
+    forecast_cache.update(entry=entry, version=rules_version)
+    if changed is None or changed:
+        keep_forecast(entry["clients_handle"], entry["portraits"],
+                      entry["deps"]["feature_name"])
+        st.info("Прогноз пересчитан" + (
+            "" if changed is None else " для портретов: " + ", ".join(sorted(changed))))
+
 # запуск прогноза
-if st.button("Запустить прогноз"):
+if mapped_df is not None and st.button("Запустить прогноз"):
     with st.spinner("Модуль прогнозирования выполняется..."):
         try:
-            clients_forecast, portraits_forecast = predictor.run_behavior_forecast(
-                mapped_df=mapped_df,
-                sim_df=sim_df,
-                portraits_rules=portraits_rules,
-                feature_hypotheses=feature_hypotheses,
-                feature_name=feature_choice,
-                train_model=train_model,
-                save_to="data"
-            )
-
-            st.session_state["forecast_clients"] = clients_forecast
-            st.session_state["forecast_portraits"] = portraits_forecast
+            if use_uplift:
+                # uplift-модель обучается по всем портретам — инкрементально не пересчитывается
+                uplift_model = uplift.get_uplift_model(
+                    feature_choice, mapped_df, portraits_rules, feature_hypotheses)
+                clients_forecast, portraits_forecast = predictor.run_behavior_forecast(
+                    mapped_df=mapped_df,
+                    sim_df=sim_df,
+                    portraits_rules=portraits_rules,
+                    feature_hypotheses=feature_hypotheses,
+                    feature_name=feature_choice,
+                    train_model=train_model,
+                    aggregate_only=not clients_detail,
+                    uplift_model=uplift_model
+                )
+                st.session_state.pop("forecast_cache", None)
+                clients_handle = None if clients_forecast is None else preview_store.put(
+                    clients_forecast, name=f"forecast_clients_{feature_choice}")
+            else:
+                entry = incremental.build_forecast_cache(
+                    mapped_df, sim_df, portraits_rules, feature_hypotheses, feature_choice,
+                    train_model=train_model, aggregate_only=not clients_detail)
+                st.session_state["forecast_cache"] = {
+                    "source": mapped_handle, "version": rules_version, "entry": entry}
+                clients_handle, portraits_forecast = entry["clients_handle"], entry["portraits"]
+
+            keep_forecast(clients_handle, portraits_forecast, feature_choice)
 
             st.success("✅ Прогноз успешно выполнен!")
         except Exception as e:
@@ -247,12 +480,12 @@ if st.button("Запустить прогноз"):
             st.stop()
 
 # резы и сохранение
-if "forecast_clients" in st.session_state and "forecast_portraits" in st.session_state:
-    clients_forecast = st.session_state["forecast_clients"]
+if "forecast_portraits" in st.session_state:
     portraits_forecast = st.session_state["forecast_portraits"]
 
-    st.markdown("### Прогноз по клиентам (первые строки)")
-    st.dataframe(clients_forecast.head())
+    if "forecast_clients_handle" in st.session_state:
+        st.markdown("### Прогноз по клиентам")
+        show_preview(st.session_state["forecast_clients_handle"], "forecast_preview")
 
     st.markdown("### Сводный прогноз по портретам")
     st.dataframe(portraits_forecast)
@@ -274,14 +507,67 @@ else:
     st.info("Чтобы увидеть результаты, выполните прогнозирование.")
 
 # текстовое описание
-if "forecast_clients" in st.session_state and "forecast_portraits" in st.session_state:
+if "forecast_portraits" in st.session_state:
     summary_text = predictor.generate_forecast_summary(
-        st.session_state["forecast_clients"],
+        None,
         st.session_state["forecast_portraits"],
         feature_name=feature_choice
     )
     st.markdown(summary_text)
 
+# === анализ чувствительности ===
+st.subheader("Анализ чувствительности")
+with st.expander("Перебор lifts и базовой вероятности отклика", expanded=False):
+    st.caption("Считается по правилам без обученной модели (closed-form прогноз).")
+    lift_visits_range = st.slider(
+        "lift_visits", -0.5, 0.5, (0.0, 0.1), step=0.01)
+    lift_spend_range = st.slider(
+        "lift_spend", -0.3, 0.5, (0.0, 0.1), step=0.01)
+    base_prob_range = st.slider(
+        "Базовая вероятность отклика (для всех портретов)", 0.0, 0.5, (0.03, 0.2), step=0.01)
+    n_scenarios = st.number_input(
+        "Число сценариев (латинский гиперкуб)", min_value=10, max_value=100000, value=2000, step=10)
+    if mapped_df is None:
+        st.info("Сначала выполните маппинг клиентов.")
+    elif st.button("Запустить перебор"):
+        scenarios = sensitivity.latin_hypercube({
+            "lift_visits": lift_visits_range,
+            "lift_spend": lift_spend_range,
+            "base_prob": base_prob_range,
+        }, n=int(n_scenarios))
+        try:
+            sweep = sensitivity.run_sensitivity_sweep(
+                mapped_df, portraits_rules, feature_hypotheses, feature_choice, scenarios)
+        except Exception as e:
+            st.error(f"Ошибка перебора: {e}")
+            st.stop()
+        # на графике не больше MAX_POINTS сценариев; таблица ниже — по всем
+        st.plotly_chart(px.scatter(
+            downsample(sweep, by=None), x="lift_visits", y="revenue_change_rel", color="base_prob",
+            title="Относительное изменение выручки по сценариям"))
+        st.dataframe(sweep.sort_values(
+            "revenue_change_abs", ascending=False).head(20))
+
+# === отчёт профилирования ===
+if profiler is not None:
+    with st.expander("Профилирование стадий", expanded=False):
+        report = profiler.get_report()
+        if report:
+            st.dataframe(profiler.report_frame())
+            for r in report:
+                if r.get("profile"):
+                    st.markdown(f"**cProfile: {r['stage']}**")
+                    st.code(r["profile"])
+            st.download_button(
+                "Скачать отчёт (JSON)",
+                data=profiler.export_json(),
+                file_name="profiling_report.json",
+                mime="application/json")
+            if st.button("Очистить отчёт"):
+                profiler.reset()
+        else:
+            st.info("Запустите маппинг, симуляцию или прогноз, чтобы собрать метрики.")
+
 # === подвал ===
 st.markdown("""
 ---
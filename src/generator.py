@@ -2,10 +2,12 @@ import pandas as pd
 import random
 from faker import Faker
 import os
+from instrumentation import instrument
 
 fake = Faker('ru_RU')
 
 
+@instrument("generator.generate_clients")
 def generate_clients(n=1000):
     data = []
     for _ in range(n):
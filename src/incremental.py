@@ -0,0 +1,226 @@
+import copy
+import pandas as pd
+import predictor
+import preview_store
+from simulator_advanced import (simulate_feature_response, simulate_responses,
+                                 response_metrics)
+from instrumentation import instrument
+
+# поля гипотезы, от которых зависит прогноз (applicable_to в прогнозе не используется)
+FORECAST_FEATURE_FIELDS = ("feature_name", "target_metric",
+                           "expected_lift_visits", "expected_lift_spend")
+# поля гипотезы, от которых зависит симуляция
+SIMULATION_FEATURE_FIELDS = ("feature_name", "target_metric")
+
+# записи кэша маленькие (зависимости, метрики, агрегат по портретам) и живут в сессии;
+# полные таблицы лежат в preview_store, в записи — только их handle.
+# update_* кладут изменённую таблицу под новым handle; старую освобождает владелец записи.
+
+# === учёт зависимостей ===
+
+
+def record_dependencies(portraits_rules: dict, feature_hypotheses: list,
+                        feature_name: str, portraits):
+    """
+    Снимок того, от чего зависит закэшированный результат по фиче:
+    запись гипотезы и значение правила target_metric для каждого портрета.
+    """
+    feature_info = predictor.infer_feature_info(
+        feature_hypotheses, feature_name)
+    target_metric = feature_info.get("target_metric")
+    portraits = sorted(set(portraits))
+    return {
+        "feature_name": feature_name,
+        "hypothesis": copy.deepcopy(feature_info),
+        "portraits": portraits,
+        "rules": {p: portraits_rules.get(p, {}).get(target_metric) for p in portraits},
+    }
+
+
+def affected_portraits(deps: dict, portraits_rules: dict, feature_hypotheses: list,
+                       fields=FORECAST_FEATURE_FIELDS, applicable: bool = False):
+    """
+    Какие портреты надо пересчитать после правки правил / гипотез.
+    Возвращает set портретов; None — если изменилось что-то общее и нужен полный пересчёт.
+    applicable: учитывать изменения списка applicable_to (нужно для симуляции).
+    """
+    old = deps["hypothesis"]
+    try:
+        new = predictor.infer_feature_info(
+            feature_hypotheses, deps["feature_name"])
+    except KeyError:
+        return None
+    if any(old.get(f) != new.get(f) for f in fields):
+        return None
+
+    changed = set()
+    if applicable:
+        changed |= set(old.get("applicable_to", [])) ^ set(
+            new.get("applicable_to", []))
+    target_metric = new.get("target_metric")
+    for p in deps["portraits"]:
+        if portraits_rules.get(p, {}).get(target_metric) != deps["rules"][p]:
+            changed.add(p)
+    return changed & set(deps["portraits"])
+
+# === кэш симуляции ===
+
+
+@instrument("incremental.build_simulation_cache")
+def build_simulation_cache(clients_df: pd.DataFrame, portraits_rules: dict,
+                           feature_hypotheses: list, feature_name: str):
+    """
+    Полная симуляция + снимок зависимостей.
+    clients_df должен содержать portrait_name.
+    Результат симуляции — в preview_store (entry["sim_handle"]).
+    """
+    sim_df, metrics = simulate_feature_response(
+        clients_df, portraits_rules, feature_hypotheses, feature_name)
+    return {
+        "kind": "simulation",
+        "deps": record_dependencies(portraits_rules, feature_hypotheses,
+                                    feature_name, sim_df["portrait_name"].dropna()),
+        "sim_handle": preview_store.put(sim_df, name="simulated_reactions"),
+        "metrics": metrics,
+    }
+
+
+@instrument("incremental.update_simulation_cache")
+def update_simulation_cache(entry: dict, clients_df: pd.DataFrame, portraits_rules: dict,
+                            feature_hypotheses: list):
+    """
+    Пересимулировать только клиентов затронутых портретов.
+    response_cluster зависит только от числовых признаков — его не трогаем.
+    Возвращает (новая запись кэша, set пересчитанных портретов или None при полном пересчёте).
+    """
+    deps = entry["deps"]
+    feature_name = deps["feature_name"]
+    changed = affected_portraits(deps, portraits_rules, feature_hypotheses,
+                                 fields=SIMULATION_FEATURE_FIELDS, applicable=True)
+    if changed is None:
+        return build_simulation_cache(clients_df, portraits_rules,
+                                      feature_hypotheses, feature_name), None
+    if not changed:
+        return entry, changed
+
+    feature_info = predictor.infer_feature_info(
+        feature_hypotheses, feature_name)
+    response_col = f"response_to_{feature_name}"
+    sim_df = preview_store.get(entry["sim_handle"]).copy()
+    mask = sim_df["portrait_name"].isin(changed)
+    sim_df.loc[mask, response_col] = simulate_responses(
+        sim_df[mask], portraits_rules, feature_info["target_metric"],
+        feature_info.get("applicable_to", []))
+
+    return {
+        "kind": "simulation",
+        "deps": record_dependencies(portraits_rules, feature_hypotheses,
+                                    feature_name, deps["portraits"]),
+        "sim_handle": preview_store.put(sim_df, name="simulated_reactions"),
+        "metrics": response_metrics(sim_df, response_col),
+    }, changed
+
+# === кэш прогноза ===
+
+
+@instrument("incremental.build_forecast_cache")
+def build_forecast_cache(mapped_df: pd.DataFrame, sim_df: pd.DataFrame, portraits_rules: dict,
+                         feature_hypotheses: list, feature_name: str, train_model: bool = True,
+                         aggregate_only: bool = False):
+    """
+    Полный прогноз run_behavior_forecast + снимок зависимостей.
+    aggregate_only: хранить только агрегат по портретам (clients_handle будет None).
+    Прогноз по клиентам — в preview_store (entry["clients_handle"]).
+    """
+    clients, portraits = predictor.run_behavior_forecast(
+        mapped_df=mapped_df,
+        sim_df=sim_df,
+        portraits_rules=portraits_rules,
+        feature_hypotheses=feature_hypotheses,
+        feature_name=feature_name,
+        train_model=train_model,
+        aggregate_only=aggregate_only,
+    )
+    response_col = f"response_to_{feature_name}"
+    return {
+        "kind": "forecast",
+        "deps": record_dependencies(portraits_rules, feature_hypotheses,
+                                    feature_name, mapped_df["portrait_name"].dropna()),
+        # модели обучаются на всех клиентах сразу — такой прогноз пересчитываем целиком
+        "trained": train_model and predictor.has_post_metrics(sim_df, feature_name),
+        # отклик взят из симуляции — правила на прогноз не влияют напрямую
+        "uses_simulation": sim_df is not None and response_col in sim_df.columns,
+        "train_model": train_model,
+        "aggregate_only": aggregate_only,
+        "clients_handle": None if clients is None else
+        preview_store.put(clients, name=f"forecast_clients_{feature_name}"),
+        "portraits": portraits,
+    }
+
+
+@instrument("incremental.update_forecast_cache")
+def update_forecast_cache(entry: dict, mapped_df: pd.DataFrame, sim_df: pd.DataFrame,
+                          portraits_rules: dict, feature_hypotheses: list,
+                          changed_by_simulation=None):
+    """
+    Пересчитать прогноз только для затронутых портретов и слить с кэшем.
+    changed_by_simulation: портреты, у которых поменялись отклики в симуляции
+    (результат update_simulation_cache).
+    mapped_df должен быть тем же, на котором строился кэш (тот же порядок клиентов).
+    Возвращает (новая запись кэша, set пересчитанных портретов или None при полном пересчёте).
+    """
+    deps = entry["deps"]
+    feature_name = deps["feature_name"]
+
+    def rebuild():
+        return build_forecast_cache(mapped_df, sim_df, portraits_rules, feature_hypotheses,
+                                    feature_name, train_model=entry["train_model"],
+                                    aggregate_only=entry.get("aggregate_only", False)), None
+
+    if entry["trained"]:
+        return rebuild()
+    changed = affected_portraits(deps, portraits_rules, feature_hypotheses)
+    if changed is None:
+        return rebuild()
+    if entry["uses_simulation"]:
+        # вероятности берутся из откликов, правила влияют только через симуляцию
+        changed = set()
+    changed |= set(changed_by_simulation or [])
+    if not changed:
+        return entry, changed
+
+    mask = mapped_df["portrait_name"].isin(changed).to_numpy()
+    part_sim = None
+    if sim_df is not None and "client_id" in sim_df.columns:
+        part_sim = sim_df[sim_df["portrait_name"].isin(changed)] \
+            if "portrait_name" in sim_df.columns else sim_df
+    part_clients, part_portraits = predictor.run_behavior_forecast(
+        mapped_df=mapped_df[mask],
+        sim_df=part_sim,
+        portraits_rules=portraits_rules,
+        feature_hypotheses=feature_hypotheses,
+        feature_name=feature_name,
+        train_model=False,
+        aggregate_only=entry.get("aggregate_only", False),
+    )
+
+    # клиенты: порядок сохраняется, заменяем строки затронутых портретов
+    clients_handle = entry["clients_handle"]
+    if clients_handle is not None and part_clients is not None:
+        clients = preview_store.get(clients_handle).copy()
+        for col in part_clients.columns:
+            clients.loc[mask, col] = part_clients[col].to_numpy()
+        clients_handle = preview_store.put(
+            clients, name=f"forecast_clients_{feature_name}")
+    # портреты: выкидываем старые строки и добавляем новые
+    portraits = pd.concat([
+        entry["portraits"][~entry["portraits"]["portrait_name"].isin(changed)],
+        part_portraits,
+    ], ignore_index=True).sort_values("portrait_name").reset_index(drop=True)
+
+    new_entry = dict(entry)
+    new_entry["deps"] = record_dependencies(portraits_rules, feature_hypotheses,
+                                            feature_name, deps["portraits"])
+    new_entry["clients_handle"] = clients_handle
+    new_entry["portraits"] = portraits
+    return new_entry, changed
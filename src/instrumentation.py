@@ -0,0 +1,267 @@
+import cProfile
+import functools
+import io
+import json
+import pstats
+import threading
+import time
+import tracemalloc
+import weakref
+from contextlib import contextmanager
+
+# активный сборщик и стек стадий — свои у каждого потока
+# (Streamlit выполняет каждую сессию в отдельном потоке одного процесса)
+_local = threading.local()
+
+# tracemalloc общий на процесс: включён, пока он нужен хотя бы одному сборщику
+_memory_lock = threading.Lock()
+_memory_users = [0]
+
+
+def _memory_acquire():
+    with _memory_lock:
+        if _memory_users[0] == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        _memory_users[0] += 1
+
+
+def _memory_release():
+    with _memory_lock:
+        _memory_users[0] = max(_memory_users[0] - 1, 0)
+        if _memory_users[0] == 0 and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+
+class Collector:
+    """
+    Сборщик метрик одной сессии: настройки и записи стадий.
+    Записи попадают сюда только из потоков, где он активирован через activate().
+    track_memory: замерять пиковую память через tracemalloc
+    (tracemalloc общий на процесс — при параллельных сессиях пики приблизительные)
+    cprofile: снимать cProfile для стадий верхнего уровня
+    """
+
+    def __init__(self, track_memory: bool = True, cprofile: bool = False):
+        self.records = []
+        self.track_memory = False
+        self.cprofile = False
+        self._release = None
+        self.set_options(track_memory, cprofile)
+
+    def set_options(self, track_memory: bool, cprofile: bool):
+        self.cprofile = cprofile
+        if track_memory and not self.track_memory:
+            _memory_acquire()
+            # если сессия закончилась без close() — освободим tracemalloc при сборке мусора
+            self._release = weakref.finalize(self, _memory_release)
+        elif not track_memory and self.track_memory:
+            self._release()
+            self._release = None
+        self.track_memory = track_memory
+
+    def close(self):
+        self.set_options(False, False)
+
+    def reset(self):
+        self.records.clear()
+
+    def get_report(self):
+        """
+        Структурированный отчёт: список стадий в порядке завершения.
+        """
+        return [dict(r) for r in self.records]
+
+    def report_frame(self):
+        """
+        Отчёт в виде DataFrame (без текстов cProfile) для вывода в приложении.
+        """
+        import pandas as pd
+        rows = []
+        for r in self.records:
+            row = {k: v for k, v in r.items() if k not in ("profile", "metrics")}
+            for k, v in r.get("metrics", {}).items():
+                row[k] = v
+            rows.append(row)
+        return pd.DataFrame(rows)
+
+    def export_json(self, path: str = None):
+        """
+        Выгрузить отчёт в JSON. Возвращает строку; если задан path — ещё и сохраняет файл.
+        """
+        payload = json.dumps(self.get_report(), ensure_ascii=False, indent=2)
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(payload)
+        return payload
+
+
+def activate(collector: Collector):
+    """
+    Писать стадии текущего потока в collector.
+    """
+    _local.collector = collector
+    _local.stack = []
+
+
+def deactivate():
+    """
+    Выключить замеры в текущем потоке (другие потоки/сессии не затрагиваются).
+    """
+    _local.collector = None
+    _local.stack = []
+
+
+def current():
+    return getattr(_local, "collector", None)
+
+
+def enable(track_memory: bool = True, cprofile: bool = False):
+    """
+    Создать сборщик и активировать его в текущем потоке (для скриптов и ноутбуков).
+    """
+    collector = Collector(track_memory, cprofile)
+    activate(collector)
+    return collector
+
+
+def disable():
+    collector = current()
+    deactivate()
+    if collector is not None:
+        collector.close()
+
+
+def is_enabled():
+    return current() is not None
+
+
+def _rows_of(obj):
+    # число строк для DataFrame / ndarray / кортежа результатов
+    if isinstance(obj, tuple) and obj:
+        obj = obj[0]
+    shape = getattr(obj, "shape", None)
+    if shape:
+        return int(shape[0])
+    return None
+
+
+@contextmanager
+def stage(name: str, rows_in=None):
+    """
+    Замер одной стадии: время, строки на входе/выходе, пиковая память, cProfile.
+    Возвращает dict записи — в него можно дописать rows_out или свои метрики.
+    Если в потоке нет активного сборщика — ничего не замеряет.
+    """
+    collector = current()
+    if collector is None:
+        yield {}
+        return
+    stack = _local.stack
+
+    record = {
+        "stage": name,
+        "parent": stack[-1]["stage"] if stack else None,
+        "depth": len(stack),
+        "rows_in": rows_in,
+        "rows_out": None,
+        "seconds": None,
+        "peak_mem_mb": None,
+    }
+    frame = {"stage": name, "peak": 0, "record": record}
+
+    track_memory = collector.track_memory and tracemalloc.is_tracing()
+    if track_memory:
+        current_mem, peak = tracemalloc.get_traced_memory()
+        # пик родителя, накопленный до нас, сохраняем перед сбросом
+        if stack:
+            stack[-1]["peak"] = max(stack[-1]["peak"], peak)
+        tracemalloc.reset_peak()
+        frame["start"] = current_mem
+
+    profiler = None
+    if collector.cprofile and not stack:
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # в процессе уже работает другой профилировщик (другая сессия)
+            profiler = None
+
+    stack.append(frame)
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["seconds"] = time.perf_counter() - start
+        stack.pop()
+
+        if profiler is not None:
+            profiler.disable()
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats(
+                "cumulative").print_stats(20)
+            record["profile"] = out.getvalue()
+
+        if track_memory and tracemalloc.is_tracing():
+            frame_peak = max(frame["peak"], tracemalloc.get_traced_memory()[1])
+            record["peak_mem_mb"] = max(
+                frame_peak - frame["start"], 0) / 1024 ** 2
+            if stack:
+                stack[-1]["peak"] = max(stack[-1]["peak"], frame_peak)
+
+        collector.records.append(record)
+
+
+def instrument(name: str = None):
+    """
+    Декоратор для функций-стадий. Если в потоке нет активного сборщика —
+    функция вызывается напрямую, без контекстного менеджера.
+    """
+    def decorator(func):
+        stage_name = name or f"{func.__module__}.{func.__name__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if getattr(_local, "collector", None) is None:
+                return func(*args, **kwargs)
+            first = args[0] if args else next(iter(kwargs.values()), None)
+            with stage(stage_name, rows_in=_rows_of(first)) as record:
+                result = func(*args, **kwargs)
+                record["rows_out"] = _rows_of(result)
+            return result
+        return wrapper
+    return decorator
+
+
+def record_metric(key: str, value):
+    """
+    Дописать произвольную метрику (например MAE модели) в текущую стадию.
+    """
+    stack = getattr(_local, "stack", None)
+    if current() is not None and stack:
+        stack[-1]["record"].setdefault("metrics", {})[key] = value
+
+
+# === отчёт активного сборщика текущего потока ===
+
+
+def get_report():
+    collector = current()
+    return collector.get_report() if collector is not None else []
+
+
+def report_frame():
+    import pandas as pd
+    collector = current()
+    return collector.report_frame() if collector is not None else pd.DataFrame()
+
+
+def export_json(path: str = None):
+    collector = current()
+    return (collector or Collector(track_memory=False)).export_json(path)
+
+
+def reset():
+    collector = current()
+    if collector is not None:
+        collector.reset()
@@ -1,8 +1,19 @@
 import json
+import os
+import glob
+from multiprocessing import Pool
 import pandas as pd
 import numpy as np
 from sklearn.preprocessing import OneHotEncoder, StandardScaler
 from sklearn.cluster import KMeans
+from instrumentation import instrument
+
+
+# категории и числовые
+CAT_FEATURES = ["client_type", "fuel_type",
+                "loyalty_card", "fuel_card", "contract"]
+NUM_FEATURES = ["visits_per_month",
+                "avg_liters_per_visit", "avg_spend_per_visit"]
 
 
 def load_portraits(path: str):
@@ -10,16 +21,22 @@ def load_portraits(path: str):
         return json.load(f)
 
 
+def fill_missing(df: pd.DataFrame, num_means):
+    # заполняем если есть пропуски: категории — "Неизвестно", числа — средними.
+    # df не меняется: возвращается новая таблица только из CAT_FEATURES + NUM_FEATURES
+    filled = df[CAT_FEATURES + NUM_FEATURES].copy()
+    filled[CAT_FEATURES] = filled[CAT_FEATURES].fillna("Неизвестно")
+    filled[NUM_FEATURES] = filled[NUM_FEATURES].fillna(num_means)
+    return filled
+
+
+@instrument("mapper.preprocess_data")
 def preprocess_data(df: pd.DataFrame):
-    # категории и числовые
-    cat_features = ["client_type", "fuel_type",
-                    "loyalty_card", "fuel_card", "contract"]
-    num_features = ["visits_per_month",
-                    "avg_liters_per_visit", "avg_spend_per_visit"]
+    cat_features = CAT_FEATURES
+    num_features = NUM_FEATURES
 
-    # заполняем если есть пропуски
-    df[cat_features] = df[cat_features].fillna("Неизвестно")
-    df[num_features] = df[num_features].fillna(df[num_features].mean())
+    # заполненная копия признаков — входной df не меняем
+    df = fill_missing(df, df[num_features].mean())
 
     # One-Hot кодирование категориальных признаков
     encoder = OneHotEncoder(sparse_output=False)
@@ -37,6 +54,7 @@ def preprocess_data(df: pd.DataFrame):
     return processed, encoder, scaler
 
 
+@instrument("mapper.cluster_clients")
 def cluster_clients(processed_df: pd.DataFrame, n_clusters=15):
     model = KMeans(n_clusters=n_clusters, random_state=42)
     clusters = model.fit_predict(processed_df)
@@ -60,7 +78,9 @@ def compute_score(client_row, portrait_criteria):
     return score
 
 
+@instrument("mapper.assign_portraits")
 def assign_portraits(df: pd.DataFrame, portraits: list):
+    # вход не меняем: возвращаем колонку portrait_name с индексом df
     assigned = []
     for idx, row in df.iterrows():
         best_score = -1
@@ -71,18 +91,109 @@ def assign_portraits(df: pd.DataFrame, portraits: list):
                 best_score = score
                 best_portrait = p["portrait_name"]
         assigned.append(best_portrait or "Неопределенный тип")
-    df["portrait_name"] = assigned
-    return df
+    return pd.Series(assigned, index=df.index, name="portrait_name", dtype=object)
 
 
+@instrument("mapper.map_clients_to_portraits")
 def map_clients_to_portraits(df: pd.DataFrame, portraits: list):
     processed, encoder, scaler = preprocess_data(df)
     model, processed_df = cluster_clients(
         processed, n_clusters=len(portraits)+5)
-    mapped_df = assign_portraits(df, portraits)
+    # результат — с заполненными пропусками (как и раньше), вход не меняется
+    filled = fill_missing(df, df[NUM_FEATURES].mean())
+    mapped_df = df.assign(**{c: filled[c] for c in filled.columns},
+                          portrait_name=assign_portraits(filled, portraits))
     return mapped_df
 
 
+# === шардирование по регионам / client_id ===
+
+
+def shard_ids(df: pd.DataFrame, n_shards: int, by: str = "region"):
+    """
+    Номер шарда для каждого клиента.
+    by="region" — все клиенты региона в одном шарде; by="hash" — по хэшу client_id.
+    Хэш детерминированный, одинаковый во всех процессах и чанках.
+    """
+    key = df["region"] if by == "region" else df["client_id"]
+    hashed = pd.util.hash_array(key.astype(str).to_numpy(dtype=object))
+    return (hashed % n_shards).astype(int)
+
+
+def _split_to_shards(source, shard_dir: str, n_shards: int, by: str, chunksize: int):
+    # раскладываем вход (DataFrame или CSV) по файлам шардов, не держа всё в памяти;
+    # попутно считаем глобальные средние числовых признаков (для fillna в воркерах)
+    os.makedirs(shard_dir, exist_ok=True)
+    for old in glob.glob(os.path.join(shard_dir, "input_*.csv")):
+        os.remove(old)
+    chunks = pd.read_csv(source, chunksize=chunksize) if isinstance(source, str) \
+        else (source.iloc[i:i + chunksize] for i in range(0, len(source), chunksize))
+    sums = pd.Series(0.0, index=NUM_FEATURES)
+    counts = pd.Series(0, index=NUM_FEATURES)
+    for chunk in chunks:
+        sums += chunk[NUM_FEATURES].sum()
+        counts += chunk[NUM_FEATURES].count()
+        ids = shard_ids(chunk, n_shards, by)
+        for shard, part in chunk.groupby(ids):
+            path = os.path.join(shard_dir, f"input_{shard:03d}.csv")
+            part.to_csv(path, mode="a", header=not os.path.exists(path), index=False)
+    means = (sums / counts.where(counts > 0)).to_dict()
+    return sorted(glob.glob(os.path.join(shard_dir, "input_*.csv"))), means
+
+
+def _assign_shard(args):
+    # воркер: читает свой шард, заполняет пропуски как preprocess_data
+    # (средние — по всему входу, а не по шарду), присваивает портреты, пишет партицию
+    input_path, portraits, out_dir, num_means = args
+    shard = os.path.basename(input_path)[len("input_"):-len(".csv")]
+    df = pd.read_csv(input_path)
+    filled = fill_missing(df, num_means)
+    df[filled.columns] = filled
+    df["portrait_name"] = assign_portraits(df, portraits)
+    out_path = os.path.join(out_dir, f"shard={shard}.csv")
+    df.to_csv(out_path, index=False)
+    return shard, out_path, df["portrait_name"].value_counts().to_dict()
+
+
+def map_clients_sharded(source, portraits: list, out_dir: str, by: str = "region",
+                        n_shards: int = 8, processes: int = None, chunksize: int = 200_000):
+    """
+    Шардированное сопоставление с портретами на нескольких процессах.
+    source: DataFrame или путь к CSV (читается чанками — out-of-core).
+    Результат пишется партициями out_dir/shard=NNN.csv, счётчики портретов
+    по шардам сливаются в portrait_counts.csv.
+
+    Кластеризация из map_clients_to_portraits здесь не выполняется:
+    её результат на присвоение портретов не влияет.
+
+    Возвращает DataFrame: portrait_name, clients_count (+ пути партиций в attrs["partitions"]).
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    for old in glob.glob(os.path.join(out_dir, "shard=*.csv")):
+        os.remove(old)
+    shard_dir = os.path.join(out_dir, "_shards")
+    inputs, num_means = _split_to_shards(
+        source, shard_dir, n_shards, by, chunksize)
+
+    tasks = [(path, portraits, out_dir, num_means) for path in inputs]
+    with Pool(processes=processes or min(len(tasks), os.cpu_count() or 1) or 1) as pool:
+        results = pool.map(_assign_shard, tasks)
+
+    for path in inputs:
+        os.remove(path)
+    os.rmdir(shard_dir)
+
+    totals = {}
+    for _, _, counts in results:
+        for portrait, n in counts.items():
+            totals[portrait] = totals.get(portrait, 0) + n
+    counts_df = pd.DataFrame(sorted(totals.items(), key=lambda x: -x[1]),
+                             columns=["portrait_name", "clients_count"])
+    counts_df.to_csv(os.path.join(out_dir, "portrait_counts.csv"), index=False)
+    counts_df.attrs["partitions"] = [path for _, path, _ in sorted(results)]
+    return counts_df
+
+
 if __name__ == "__main__":
     df = pd.read_csv("data/synthetic.csv")
     portraits = load_portraits("src/portraits.json")
@@ -6,6 +6,7 @@ from sklearn.ensemble import RandomForestRegressor
 from sklearn.preprocessing import OneHotEncoder, StandardScaler
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import mean_absolute_error, r2_score
+from instrumentation import instrument, stage, record_metric
 
 
 def load_json(path: str):
@@ -71,9 +72,125 @@ def estimate_response_prob(row, portraits_rules, target_metric):
     prob = min(prob, 0.99)
     return prob
 
+
+def resolve_lifts(feature_info):
+    """
+    Lifts фичи: expected_lift_* из гипотезы, а если их нет — compute_default_lifts().
+    Возвращает dict: {'lift_visits': float, 'lift_spend': float}
+    """
+    lifts = {}
+    lifts["lift_visits"] = feature_info.get("expected_lift_visits")
+    lifts["lift_spend"] = feature_info.get("expected_lift_spend")
+    # если нет — вычисляем дефолтные
+    defaults = compute_default_lifts(feature_info)
+    if lifts["lift_visits"] is None:
+        lifts["lift_visits"] = defaults["lift_visits"]
+    if lifts["lift_spend"] is None:
+        lifts["lift_spend"] = defaults["lift_spend"]
+    return lifts
+
+
+def rule_base_probs(portraits_rules, target_metric):
+    """
+    Базовая вероятность отклика по портретам (как в estimate_response_prob).
+    Возвращает dict: {portrait_name: float}
+    """
+    bases = {}
+    for portrait, rules in portraits_rules.items():
+        base = rules.get(target_metric, None)
+        bases[portrait] = 0.03 if base is None else float(base)
+    return bases
+
+
+def activity_from_arrays(visits: np.ndarray, spend: np.ndarray):
+    """
+    Вклад активности по numpy-массивам визитов и среднего чека
+    (например, по view колонок SharedFrame — без сборки DataFrame).
+    """
+    visits_factor = np.minimum(visits / 12.0, 1.0)
+    spend_factor = np.minimum(spend / 10000.0, 1.0)
+    return 0.4 * visits_factor + 0.2 * spend_factor
+
+
+def response_activity(df: pd.DataFrame):
+    """
+    Вклад активности клиента в вероятность отклика (векторная часть estimate_response_prob).
+    """
+    def col(name):
+        if name in df.columns:
+            return df[name].to_numpy(dtype=float)
+        return np.zeros(len(df))
+    return activity_from_arrays(col("visits_per_month"), col("avg_spend_per_visit"))
+
+
+def base_probs_by_code(names, portraits_rules, target_metric):
+    """
+    Базовая вероятность для каждого кода портрета; последний элемент — для кода -1.
+    """
+    bases = rule_base_probs(portraits_rules, target_metric)
+    return np.array([bases.get(n, 0.03) for n in names] + [0.03])
+
+
+def portrait_codes(portrait_names: pd.Series):
+    """
+    Целочисленные коды портретов и их имена (-1 для пропусков).
+    Для категориальной колонки коды берутся готовые, без factorize.
+    """
+    if isinstance(portrait_names.dtype, pd.CategoricalDtype):
+        return portrait_names.cat.codes.to_numpy(), portrait_names.cat.categories
+    return pd.factorize(portrait_names, sort=True)
+
+
+def estimate_response_probs(df: pd.DataFrame, portraits_rules, target_metric, codes=None):
+    """
+    Векторная версия estimate_response_prob для всего DataFrame.
+    codes: готовый результат portrait_codes(df["portrait_name"]) (если уже посчитан)
+    """
+    if codes is None:
+        codes = portrait_codes(df["portrait_name"])
+    codes_arr, names = codes
+    base_by_code = base_probs_by_code(names, portraits_rules, target_metric)
+    prob = base_by_code[codes_arr] + response_activity(df)
+    return np.minimum(prob, 0.99)
+
+
+def add_change_columns(agg: pd.DataFrame):
+    """
+    Абсолютные и относительные изменения визитов и выручки в агрегате по портретам.
+    """
+    agg["visits_change_abs"] = agg["predicted_visits"] - agg["baseline_visits"]
+    agg["revenue_change_abs"] = agg["predicted_revenue"] - agg["baseline_revenue"]
+    agg["visits_change_rel"] = agg["visits_change_abs"] / \
+        (agg["baseline_visits"] + 1e-9)
+    agg["revenue_change_rel"] = agg["revenue_change_abs"] / \
+        (agg["baseline_revenue"] + 1e-9)
+    return agg
+
+def post_metric_columns(feature_name):
+    """
+    Возможные названия колонок post-метрик в sim_df — гибкость.
+    Возвращает (колонки визитов, колонки чека).
+    """
+    possible_visits_post = [
+        f"visits_after_{feature_name}", f"visits_post_{feature_name}", "visits_after", "visits_post"]
+    possible_spend_post = [
+        f"spend_after_{feature_name}", f"spend_post_{feature_name}", "spend_after", "spend_post", "avg_spend_post"]
+    return possible_visits_post, possible_spend_post
+
+
+def has_post_metrics(sim_df, feature_name):
+    """
+    Есть ли в sim_df хотя бы одна колонка post-метрик для обучения моделей.
+    """
+    if sim_df is None:
+        return False
+    visits_cols, spend_cols = post_metric_columns(feature_name)
+    return any(c in sim_df.columns for c in visits_cols + spend_cols)
+
 # === основная функция ===
 
 
+@instrument("predictor.run_behavior_forecast")
 def run_behavior_forecast(
     mapped_df: pd.DataFrame,
     sim_df: pd.DataFrame,
@@ -81,7 +198,9 @@ def run_behavior_forecast(
     feature_hypotheses: list,
     feature_name: str,
     train_model: bool = True,
-    save_to: str = None
+    save_to: str = None,
+    aggregate_only: bool = False,
+    uplift_model=None
 ):
     """
     Построить прогноз изменения визитов и среднего чека для каждого клиента при запуске feature_name.
@@ -94,11 +213,26 @@ def run_behavior_forecast(
     - feature_name: имя фичи для симуляции
     - train_model: если True и в sim_df есть наблюдаемые цели — обучаем регрессоры
     - save_to: путь (папка) для сохранения результатов CSV (опционально)
+    - aggregate_only: если модель обучать не нужно — считаем только агрегат по портретам
+      (run_portrait_forecast), client_forecast_df будет None
+    - uplift_model: обученная uplift.UpliftModel — если регрессоры не обучались,
+      относительные изменения берутся из неё вместо 1 + prob * lift
 
     Возвращает tuple (client_forecast_df, portrait_agg_df)
     """
-    # копируем исходный DF
-    df = mapped_df.copy().reset_index(drop=True)
+    if aggregate_only and uplift_model is None and \
+            not (train_model and has_post_metrics(sim_df, feature_name)):
+        agg = run_portrait_forecast(
+            mapped_df, sim_df, portraits_rules, feature_hypotheses, feature_name)
+        if save_to:
+            os.makedirs(save_to, exist_ok=True)
+            agg.to_csv(os.path.join(
+                save_to, f"forecast_portraits_{feature_name}.csv"), index=False)
+        return None, agg
+
+    # поверхностная копия: базовые колонки не копируются, новые добавляются только в df
+    df = mapped_df.copy(deep=False)
+    df.index = pd.RangeIndex(len(df))
     if "client_id" not in df.columns:
         df["client_id"] = df.index.astype(str)
 
@@ -108,15 +242,7 @@ def run_behavior_forecast(
     applicable = feature_info.get("applicable_to", [])
 
     # определяем lifts
-    lifts = {}
-    lifts["lift_visits"] = feature_info.get("expected_lift_visits")
-    lifts["lift_spend"] = feature_info.get("expected_lift_spend")
-    # если нет — вычисляем дефолтные
-    defaults = compute_default_lifts(feature_info)
-    if lifts["lift_visits"] is None:
-        lifts["lift_visits"] = defaults["lift_visits"]
-    if lifts["lift_spend"] is None:
-        lifts["lift_spend"] = defaults["lift_spend"]
+    lifts = resolve_lifts(feature_info)
 
     # попытка извлечь отклик из sim_df
     response_col = f"response_to_{feature_name}"
@@ -127,14 +253,15 @@ def run_behavior_forecast(
         df = df.merge(sim_df[["client_id", response_col]] if has_response_column else sim_df[[
                       "client_id"]], on="client_id", how="left")
 
-    # если нет реального отклика, оцениваем вероятность отклика
-    if not has_response_column:
-        df[f"{response_col}_prob"] = df.apply(
-            lambda r: estimate_response_prob(r, portraits_rules, target_metric), axis=1)
-        # имитация бинарного отклика при необходимости (например для обучения) — не делаем без данных
-    else:
-        # есть бинарный отклик 0/1 — можем вычислить empirical lift при отклике
-        df[f"{response_col}_prob"] = df[response_col]  # 0/1
+    with stage("predictor.response_prob", rows_in=len(df)):
+        # если нет реального отклика, оцениваем вероятность отклика
+        if not has_response_column:
+            df[f"{response_col}_prob"] = estimate_response_probs(
+                df, portraits_rules, target_metric)
+            # имитация бинарного отклика при необходимости (например для обучения) — не делаем без данных
+        else:
+            # есть бинарный отклик 0/1 — можем вычислить empirical lift при отклике
+            df[f"{response_col}_prob"] = df[response_col]  # 0/1
 
     # подготовка признаков для возможного обучения / предсказания
     feat_num = ["visits_per_month",
@@ -158,11 +285,8 @@ def run_behavior_forecast(
     y_visits = None
     y_spend = None
     if sim_df is not None:
-        # возможные названия колонок — гибкость
-        possible_visits_post = [
-            f"visits_after_{feature_name}", f"visits_post_{feature_name}", "visits_after", "visits_post"]
-        possible_spend_post = [
-            f"spend_after_{feature_name}", f"spend_post_{feature_name}", "spend_after", "spend_post", "avg_spend_post"]
+        possible_visits_post, possible_spend_post = post_metric_columns(
+            feature_name)
         for col in possible_visits_post:
             if col in sim_df.columns:
                 df = df.merge(sim_df[["client_id", col]],
@@ -182,35 +306,47 @@ def run_behavior_forecast(
     can_train = train_model and (y_visits is not None or y_spend is not None)
 
     if can_train:
-        if y_visits is not None:
-            # целевая переменная — относительное изменение (post / pre)
-            baseline = df["visits_per_month"].values.astype(float) + 1e-6
-            y_rel_visits = y_visits / baseline
-            X_train, X_val, y_train, y_val = train_test_split(
-                X, y_rel_visits, test_size=0.2, random_state=42)
-            model_visits = RandomForestRegressor(
-                n_estimators=100, random_state=42)
-            model_visits.fit(X_train, y_train)
-            pred = model_visits.predict(X_val)
-            print("Visits model MAE:", mean_absolute_error(
-                y_val, pred), "R2:", r2_score(y_val, pred))
-        if y_spend is not None:
-            baseline_spend = df["avg_spend_per_visit"].values.astype(
-                float) + 1e-6
-            y_rel_spend = y_spend / baseline_spend
-            X_train, X_val, y_train, y_val = train_test_split(
-                X, y_rel_spend, test_size=0.2, random_state=42)
-            model_spend = RandomForestRegressor(
-                n_estimators=100, random_state=42)
-            model_spend.fit(X_train, y_train)
-            pred = model_spend.predict(X_val)
-            print("Spend model MAE:", mean_absolute_error(
-                y_val, pred), "R2:", r2_score(y_val, pred))
+        with stage("predictor.train_models", rows_in=len(df)):
+            if y_visits is not None:
+                # целевая переменная — относительное изменение (post / pre)
+                baseline = df["visits_per_month"].values.astype(float) + 1e-6
+                y_rel_visits = y_visits / baseline
+                X_train, X_val, y_train, y_val = train_test_split(
+                    X, y_rel_visits, test_size=0.2, random_state=42)
+                model_visits = RandomForestRegressor(
+                    n_estimators=100, random_state=42)
+                model_visits.fit(X_train, y_train)
+                pred = model_visits.predict(X_val)
+                mae, r2 = mean_absolute_error(y_val, pred), r2_score(y_val, pred)
+                record_metric("visits_mae", float(mae))
+                record_metric("visits_r2", float(r2))
+                print("Visits model MAE:", mae, "R2:", r2)
+            if y_spend is not None:
+                baseline_spend = df["avg_spend_per_visit"].values.astype(
+                    float) + 1e-6
+                y_rel_spend = y_spend / baseline_spend
+                X_train, X_val, y_train, y_val = train_test_split(
+                    X, y_rel_spend, test_size=0.2, random_state=42)
+                model_spend = RandomForestRegressor(
+                    n_estimators=100, random_state=42)
+                model_spend.fit(X_train, y_train)
+                pred = model_spend.predict(X_val)
+                mae, r2 = mean_absolute_error(y_val, pred), r2_score(y_val, pred)
+                record_metric("spend_mae", float(mae))
+                record_metric("spend_r2", float(r2))
+                print("Spend model MAE:", mae, "R2:", r2)
 
     # предсказание эффекта: комбинируем вероятности отклика и lift-ы
     # если обученные модели есть — используем их для предсказания относительного изменения
+    uplift_rel = None
+    if uplift_model is not None and (model_visits is None or model_spend is None):
+        with stage("predictor.uplift_predict", rows_in=len(df)):
+            uplift_rel = uplift_model.predict_relative(df)
+
     if model_visits is not None:
         rel_visits_pred = model_visits.predict(X)
+    elif uplift_rel is not None:
+        rel_visits_pred = uplift_rel[0]
     else:
         # baseline multiplier = 1 + prob * lift_visits
         rel_visits_pred = 1.0 + \
@@ -218,6 +354,8 @@ def run_behavior_forecast(
 
     if model_spend is not None:
         rel_spend_pred = model_spend.predict(X)
+    elif uplift_rel is not None:
+        rel_spend_pred = uplift_rel[1]
     else:
         rel_spend_pred = 1.0 + \
             df[f"{response_col}_prob"].values * lifts["lift_spend"]
@@ -240,20 +378,16 @@ def run_behavior_forecast(
     df["predicted_revenue"] = df["predicted_visits"] * df["predicted_spend"]
     df["revenue_change"] = df["predicted_revenue"] - df["baseline_revenue"]
 
-    # агрегаты по портретам
-    agg = df.groupby("portrait_name").agg(
-        clients_count=("client_id", "count"),
-        baseline_visits=("baseline_visits", "sum"),
-        predicted_visits=("predicted_visits", "sum"),
-        baseline_revenue=("baseline_revenue", "sum"),
-        predicted_revenue=("predicted_revenue", "sum"),
-    ).reset_index()
-    agg["visits_change_abs"] = agg["predicted_visits"] - agg["baseline_visits"]
-    agg["revenue_change_abs"] = agg["predicted_revenue"] - agg["baseline_revenue"]
-    agg["visits_change_rel"] = agg["visits_change_abs"] / \
-        (agg["baseline_visits"] + 1e-9)
-    agg["revenue_change_rel"] = agg["revenue_change_abs"] / \
-        (agg["baseline_revenue"] + 1e-9)
+    with stage("predictor.aggregate", rows_in=len(df)):
+        # агрегаты по портретам
+        agg = df.groupby("portrait_name").agg(
+            clients_count=("client_id", "count"),
+            baseline_visits=("baseline_visits", "sum"),
+            predicted_visits=("predicted_visits", "sum"),
+            baseline_revenue=("baseline_revenue", "sum"),
+            predicted_revenue=("predicted_revenue", "sum"),
+        ).reset_index()
+        agg = add_change_columns(agg)
 
     # сохранение результатов
     if save_to:
@@ -270,20 +404,84 @@ def run_behavior_forecast(
         "client_id", "portrait_name", "baseline_visits", "predicted_visits", "delta_visits",
         "baseline_spend", "predicted_spend", "delta_spend", "baseline_revenue", "predicted_revenue", "revenue_change"
     ]
-    return df[client_cols].copy(), agg.copy()
+    # регион нужен для разреза регион × портрет (скетчи), если он есть во входе
+    if "region" in df.columns:
+        client_cols.insert(2, "region")
+    return df[client_cols], agg
+
+
+@instrument("predictor.run_portrait_forecast")
+def run_portrait_forecast(
+    mapped_df: pd.DataFrame,
+    sim_df: pd.DataFrame,
+    portraits_rules: dict,
+    feature_hypotheses: list,
+    feature_name: str,
+):
+    """
+    Быстрый прогноз только на уровне портретов (без обучения моделей).
+    Тот же closed-form расчёт, что и в run_behavior_forecast, но без
+    покликентного DataFrame: суммы собираются np.bincount по кодам портретов.
+
+    Возвращает DataFrame с теми же колонками, что portrait_agg_df из run_behavior_forecast.
+    """
+    feature_info = infer_feature_info(feature_hypotheses, feature_name)
+    target_metric = feature_info.get("target_metric")
+    lifts = resolve_lifts(feature_info)
+
+    codes, names = portrait_codes(mapped_df["portrait_name"])
+
+    response_col = f"response_to_{feature_name}"
+    if sim_df is not None and response_col in sim_df.columns and "client_id" in mapped_df.columns:
+        # наблюдаемый отклик 0/1 из симуляции (клиенты без отклика — NaN, как в merge)
+        responses = sim_df.drop_duplicates("client_id").set_index("client_id")[response_col]
+        prob = mapped_df["client_id"].map(responses).to_numpy(dtype=float)
+    else:
+        prob = estimate_response_probs(
+            mapped_df, portraits_rules, target_metric, codes=(codes, names))
+
+    # NaN не суммируем — как groupby.sum; обрабатываем один раз на входе:
+    # клиент без отклика в симуляции даёт 0 в predicted_*, но учитывается в baseline_*
+    baseline_visits = np.nan_to_num(mapped_df["visits_per_month"].to_numpy(dtype=float))
+    baseline_spend = np.nan_to_num(mapped_df["avg_spend_per_visit"].to_numpy(dtype=float))
+    observed = ~np.isnan(prob)
+    rel_visits = np.where(observed, np.clip(1.0 + prob * lifts["lift_visits"], 0.5, 5.0), 0.0)
+    rel_spend = np.where(observed, np.clip(1.0 + prob * lifts["lift_spend"], 0.7, 5.0), 0.0)
+    baseline_revenue = baseline_visits * baseline_spend
+
+    # клиенты без портрета (код -1) в groupby не попадают — уводим их в лишнюю корзину n
+    n = len(names)
+    bins = np.where(codes >= 0, codes, n)
+
+    def total(values):
+        return np.bincount(bins, weights=values, minlength=n + 1)[:n]
+
+    agg = pd.DataFrame({
+        "portrait_name": np.asarray(names),
+        "clients_count": np.bincount(bins, minlength=n + 1)[:n],
+        "baseline_visits": total(baseline_visits),
+        "predicted_visits": total(baseline_visits * rel_visits),
+        "baseline_revenue": total(baseline_revenue),
+        "predicted_revenue": total(baseline_revenue * rel_visits * rel_spend),
+    })
+    agg = agg[agg["clients_count"] > 0].reset_index(drop=True)
+    return add_change_columns(agg)
 
 
 def generate_forecast_summary(clients_forecast, portraits_forecast, feature_name: str = ""):
     """
     Генерация красиво оформленного текстового отчёта
     по результатам прогнозирования для менеджеров.
+    Итоги берутся из агрегата по портретам (полный прогноз по клиентам не нужен);
+    clients_forecast используется, только если агрегата нет.
     """
 
+    totals_source = portraits_forecast if portraits_forecast is not None else clients_forecast
     try:
-        total_visits_before = clients_forecast["baseline_visits"].sum()
-        total_visits_after = clients_forecast["predicted_visits"].sum()
-        total_spend_before = clients_forecast["baseline_revenue"].sum()
-        total_spend_after = clients_forecast["predicted_revenue"].sum()
+        total_visits_before = totals_source["baseline_visits"].sum()
+        total_visits_after = totals_source["predicted_visits"].sum()
+        total_spend_before = totals_source["baseline_revenue"].sum()
+        total_spend_after = totals_source["predicted_revenue"].sum()
     except KeyError:
         raise KeyError(
             "Не найдены необходимые столбцы для анализа (baseline/predicted).")
@@ -0,0 +1,179 @@
+import os
+import glob
+import time
+import uuid
+import threading
+from collections import OrderedDict
+import pandas as pd
+
+# общий для всех сессий склад больших таблиц:
+# полные результаты лежат один раз на диске (+ горячие — в памяти процесса),
+# в st.session_state хранится только строковый handle
+STORE_DIR = "data/store"
+# горячие таблицы держим в памяти в пределах бюджета по байтам (общего на процесс):
+# у каждой сессии несколько handle, лимит по числу таблиц вытеснял их на каждом rerun
+MAX_IN_MEMORY_BYTES = 1024 ** 3
+DEFAULT_PAGE_SIZE = 50
+# таблицы, к которым не обращались дольше TTL, удаляются (сессия могла закончиться)
+TTL_SECONDS = 6 * 3600
+CLEANUP_EVERY_SECONDS = 600
+
+_frames = OrderedDict()   # handle -> DataFrame (LRU)
+_sizes = {}               # handle -> байты в памяти
+_meta = {}                # handle -> {"rows", "columns", "path", "name"}
+_counts = {}              # (handle, column) -> value_counts
+_lock = threading.Lock()
+_last_cleanup = [0.0]
+
+
+def _path(handle: str):
+    return os.path.join(STORE_DIR, f"{handle}.pkl")
+
+
+def _touch(handle: str, df: pd.DataFrame):
+    if handle not in _sizes:
+        _sizes[handle] = int(df.memory_usage(index=True, deep=True).sum())
+    _frames[handle] = df
+    _frames.move_to_end(handle)
+    # самую свежую таблицу оставляем, даже если она одна больше бюджета
+    while len(_frames) > 1 and sum(_sizes[h] for h in _frames) > MAX_IN_MEMORY_BYTES:
+        old, _ = _frames.popitem(last=False)
+        _sizes.pop(old, None)
+
+
+def _forget(handle: str):
+    _frames.pop(handle, None)
+    _sizes.pop(handle, None)
+
+
+def _mark_used(path: str):
+    # время последнего обращения — по mtime файла, общее для всех процессов
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        pass
+
+
+def cleanup(ttl_seconds: float = TTL_SECONDS):
+    """
+    Удалить таблицы, к которым не обращались дольше ttl_seconds.
+    Возвращает число удалённых файлов.
+    """
+    now = time.time()
+    removed = 0
+    for path in glob.glob(os.path.join(STORE_DIR, "*.pkl")):
+        try:
+            if now - os.path.getmtime(path) <= ttl_seconds:
+                continue
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        handle = os.path.basename(path)[:-len(".pkl")]
+        with _lock:
+            _forget(handle)
+            _meta.pop(handle, None)
+            for key in [k for k in _counts if k[0] == handle]:
+                del _counts[key]
+        removed += 1
+    _last_cleanup[0] = now
+    return removed
+
+
+def put(df: pd.DataFrame, name: str = None):
+    """
+    Сохранить полный DataFrame в хранилище. Возвращает handle.
+    Заодно (не чаще раза в CLEANUP_EVERY_SECONDS) удаляет устаревшие таблицы.
+    """
+    if time.time() - _last_cleanup[0] > CLEANUP_EVERY_SECONDS:
+        cleanup()
+    handle = uuid.uuid4().hex
+    os.makedirs(STORE_DIR, exist_ok=True)
+    path = _path(handle)
+    df.to_pickle(path)
+    with _lock:
+        _meta[handle] = {
+            "rows": len(df),
+            "columns": list(df.columns),
+            "path": path,
+            "name": name,
+        }
+        _touch(handle, df)
+    return handle
+
+
+def exists(handle: str):
+    return handle is not None and os.path.exists(_path(handle))
+
+
+def get(handle: str):
+    """
+    Полный DataFrame по handle (из памяти или с диска).
+    Для вычислений на сервере; в браузер его не отдаём.
+    """
+    path = _meta.get(handle, {}).get("path", _path(handle))
+    _mark_used(path)
+    with _lock:
+        if handle in _frames:
+            _frames.move_to_end(handle)
+            return _frames[handle]
+    if not os.path.exists(path):
+        raise KeyError(f"Таблица '{handle}' не найдена в хранилище.")
+    df = pd.read_pickle(path)
+    with _lock:
+        if handle not in _meta:
+            _meta[handle] = {"rows": len(df), "columns": list(df.columns),
+                             "path": path, "name": None}
+        _touch(handle, df)
+    return df
+
+
+def info(handle: str):
+    """
+    Метаданные таблицы: число строк, колонки, имя.
+    """
+    if handle not in _meta:
+        get(handle)
+    return dict(_meta[handle])
+
+
+def n_pages(handle: str, page_size: int = DEFAULT_PAGE_SIZE):
+    rows = info(handle)["rows"]
+    return max((rows + page_size - 1) // page_size, 1)
+
+
+def get_page(handle: str, page: int = 0, page_size: int = DEFAULT_PAGE_SIZE, columns: list = None):
+    """
+    Страница таблицы: строки [page*page_size, (page+1)*page_size) и только нужные колонки.
+    """
+    df = get(handle)
+    if columns:
+        columns = [c for c in columns if c in df.columns]
+    start = max(page, 0) * page_size
+    part = df.iloc[start:start + page_size]
+    if columns:
+        part = part[columns]
+    return part.copy()
+
+
+def value_counts(handle: str, column: str):
+    """
+    value_counts по колонке, считается один раз на handle.
+    """
+    key = (handle, column)
+    if key not in _counts:
+        _counts[key] = get(handle)[column].value_counts()
+    return _counts[key]
+
+
+def release(handle: str):
+    """
+    Удалить таблицу из памяти и с диска.
+    """
+    with _lock:
+        _forget(handle)
+        meta = _meta.pop(handle, None)
+        for key in [k for k in _counts if k[0] == handle]:
+            del _counts[key]
+    path = meta["path"] if meta else _path(handle)
+    if os.path.exists(path):
+        os.remove(path)
@@ -0,0 +1,195 @@
+import itertools
+import numpy as np
+import pandas as pd
+from predictor import (infer_feature_info, resolve_lifts, rule_base_probs,
+                       response_activity, portrait_codes)
+from instrumentation import instrument
+
+# верхняя граница вероятности отклика (как в estimate_response_prob)
+PROB_CAP = 0.99
+# допустимые lifts: при них clip в run_behavior_forecast не срабатывает
+LIFT_VISITS_RANGE = (-0.5 / PROB_CAP, 4.0 / PROB_CAP)
+LIFT_SPEND_RANGE = (-0.3 / PROB_CAP, 4.0 / PROB_CAP)
+
+# === подготовка достаточных статистик ===
+
+
+def _prefix(x):
+    return np.concatenate([[0.0], np.cumsum(x)])
+
+
+@instrument("sensitivity.prepare_sweep")
+def prepare_sweep(mapped_df: pd.DataFrame, portraits_rules: dict,
+                  feature_hypotheses: list, feature_name: str):
+    """
+    Один проход по клиентам: для каждого портрета сортируем вклад активности
+    и считаем префиксные суммы. Дальше любой сценарий считается за O(log n) на портрет.
+
+    Без обученной модели прогноз run_behavior_forecast имеет вид
+    predicted_visits = bv * (1 + p * lift_visits),
+    predicted_revenue = bv * bs * (1 + p * lift_visits) * (1 + p * lift_spend),
+    где p = min(base_портрета + activity, 0.99) — полином от параметров.
+    """
+    feature_info = infer_feature_info(feature_hypotheses, feature_name)
+    target_metric = feature_info.get("target_metric")
+
+    activity = response_activity(mapped_df)
+    bv = mapped_df["visits_per_month"].to_numpy(dtype=float)
+    bs = mapped_df["avg_spend_per_visit"].to_numpy(dtype=float)
+    w = bv * bs
+    codes, portraits = portrait_codes(mapped_df["portrait_name"])
+
+    bases = rule_base_probs(portraits_rules, target_metric)
+    stats = {}
+    for i, portrait in enumerate(portraits):
+        mask = codes == i
+        order = np.argsort(activity[mask], kind="stable")
+        a = activity[mask][order]
+        v = bv[mask][order]
+        r = w[mask][order]
+        stats[portrait] = {
+            "activity": a,
+            "clients": int(mask.sum()),
+            "v": _prefix(v), "va": _prefix(v * a),
+            "w": _prefix(r), "wa": _prefix(r * a), "waa": _prefix(r * a * a),
+            "base": bases.get(portrait, 0.03),
+        }
+
+    return {
+        "feature_name": feature_name,
+        "lifts": resolve_lifts(feature_info),
+        "portraits": list(portraits),
+        "stats": stats,
+    }
+
+
+# === генерация сценариев ===
+
+
+def make_grid(ranges: dict, steps: int = 5):
+    """
+    Полная сетка сценариев.
+    ranges: {"lift_visits": (0.0, 0.1), "base_prob": [0.05, 0.1], ...}
+    Кортеж (min, max) разбивается на steps точек, список берётся как есть.
+    """
+    axes = {}
+    for name, values in ranges.items():
+        if isinstance(values, tuple):
+            values = np.linspace(values[0], values[1], steps)
+        axes[name] = list(values)
+    rows = list(itertools.product(*axes.values()))
+    return pd.DataFrame(rows, columns=list(axes.keys()))
+
+
+def latin_hypercube(ranges: dict, n: int = 1000, seed: int = 42):
+    """
+    Латинский гиперкуб на n сценариев по диапазонам {параметр: (min, max)}.
+    """
+    rng = np.random.default_rng(seed)
+    data = {}
+    for name, (lo, hi) in ranges.items():
+        # по одной точке в каждом из n слоёв, слои перемешаны
+        u = (rng.permutation(n) + rng.random(n)) / n
+        data[name] = lo + u * (hi - lo)
+    return pd.DataFrame(data)
+
+
+# === расчёт сценариев ===
+
+
+def _param(scenarios: pd.DataFrame, name: str, default):
+    if name in scenarios.columns:
+        return scenarios[name].to_numpy(dtype=float)
+    return np.full(len(scenarios), float(default))
+
+
+@instrument("sensitivity.run_sweep")
+def run_sweep(state: dict, scenarios: pd.DataFrame, by_portrait: bool = False):
+    """
+    Посчитать прогноз для каждого сценария.
+
+    Колонки scenarios (все необязательные):
+    - lift_visits, lift_spend — lifts фичи
+    - base_prob — базовая вероятность отклика для всех портретов
+    - base_prob__<портрет> — базовая вероятность для конкретного портрета
+    Отсутствующие параметры берутся из гипотезы и behavior_rules.json.
+
+    Возвращает DataFrame по сценариям (или сценарий × портрет при by_portrait=True)
+    с baseline/predicted visits и revenue и их изменениями.
+    """
+    if scenarios is None or len(scenarios) == 0:
+        raise ValueError("Нет сценариев для перебора: передайте хотя бы одну строку.")
+    scenarios = scenarios.reset_index(drop=True)
+    lv = _param(scenarios, "lift_visits", state["lifts"]["lift_visits"])
+    ls = _param(scenarios, "lift_spend", state["lifts"]["lift_spend"])
+    for name, values, (lo, hi) in [("lift_visits", lv, LIFT_VISITS_RANGE),
+                                   ("lift_spend", ls, LIFT_SPEND_RANGE)]:
+        if values.min() < lo or values.max() > hi:
+            raise ValueError(
+                f"{name} вне диапазона [{lo:.3f}, {hi:.3f}]: прогноз упирается в ограничения clip.")
+    common_base = scenarios["base_prob"].to_numpy(
+        dtype=float) if "base_prob" in scenarios.columns else None
+
+    parts = []
+    for portrait in state["portraits"]:
+        ps = state["stats"][portrait]
+        if f"base_prob__{portrait}" in scenarios.columns or common_base is None:
+            b = _param(scenarios, f"base_prob__{portrait}", ps["base"])
+        else:
+            b = common_base
+        if b.min() < 0:
+            raise ValueError("Базовая вероятность отклика не может быть отрицательной.")
+
+        # клиенты с activity <= cap - b не упираются в cap: p = b + activity
+        k = np.searchsorted(ps["activity"], PROB_CAP - b, side="right")
+        v_u, va_u = ps["v"][k], ps["va"][k]
+        w_u, wa_u, waa_u = ps["w"][k], ps["wa"][k], ps["waa"][k]
+        v_c = ps["v"][-1] - v_u
+        w_c = ps["w"][-1] - w_u
+
+        pred_visits = (v_u + lv * (b * v_u + va_u)
+                       + v_c * (1 + PROB_CAP * lv))
+        pred_revenue = (w_u + (lv + ls) * (b * w_u + wa_u)
+                        + lv * ls * (b * b * w_u + 2 * b * wa_u + waa_u)
+                        + w_c * (1 + PROB_CAP * lv) * (1 + PROB_CAP * ls))
+
+        parts.append(pd.DataFrame({
+            "scenario": scenarios.index,
+            "portrait_name": portrait,
+            "clients_count": ps["clients"],
+            "baseline_visits": ps["v"][-1],
+            "predicted_visits": pred_visits,
+            "baseline_revenue": ps["w"][-1],
+            "predicted_revenue": pred_revenue,
+        }))
+
+    result = pd.concat(parts, ignore_index=True)
+    if not by_portrait:
+        result = result.groupby("scenario").agg(
+            clients_count=("clients_count", "sum"),
+            baseline_visits=("baseline_visits", "sum"),
+            predicted_visits=("predicted_visits", "sum"),
+            baseline_revenue=("baseline_revenue", "sum"),
+            predicted_revenue=("predicted_revenue", "sum"),
+        ).reset_index()
+    result["visits_change_abs"] = result["predicted_visits"] - \
+        result["baseline_visits"]
+    result["revenue_change_abs"] = result["predicted_revenue"] - \
+        result["baseline_revenue"]
+    result["revenue_change_rel"] = result["revenue_change_abs"] / \
+        (result["baseline_revenue"] + 1e-9)
+
+    # параметры сценария рядом с результатом
+    return scenarios.rename_axis("scenario").reset_index().merge(
+        result, on="scenario")
+
+
+def run_sensitivity_sweep(mapped_df: pd.DataFrame, portraits_rules: dict,
+                          feature_hypotheses: list, feature_name: str,
+                          scenarios: pd.DataFrame, by_portrait: bool = False):
+    """
+    prepare_sweep + run_sweep за один вызов.
+    """
+    state = prepare_sweep(mapped_df, portraits_rules,
+                          feature_hypotheses, feature_name)
+    return run_sweep(state, scenarios, by_portrait=by_portrait)
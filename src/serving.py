@@ -0,0 +1,256 @@
+import argparse
+import json
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import pandas as pd
+import predictor
+import uplift
+from mapper import load_portraits, assign_portraits
+
+# локальный сервис прогнозов: справочники и модели грузятся один раз,
+# параллельные запросы склеиваются в микро-батчи и считаются одним векторным вызовом
+
+MAX_BATCH_ROWS = 50_000
+MAX_WAIT_MS = 5
+NUMERIC_COLS = ["visits_per_month",
+                "avg_liters_per_visit", "avg_spend_per_visit"]
+FORECAST_COLS = ["client_id", "portrait_name", "baseline_visits", "predicted_visits",
+                 "baseline_spend", "predicted_spend", "baseline_revenue", "predicted_revenue"]
+
+
+class _Request:
+    def __init__(self, clients: pd.DataFrame):
+        self.clients = clients
+        self.enqueued = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.batch_size = 0
+
+
+class ForecastService:
+    """
+    Тёплый сервис прогнозов по клиентам.
+    Для каждой фичи своя очередь и поток-батчер.
+    """
+
+    def __init__(self, portraits_path: str = "src/portraits.json",
+                 rules_path: str = "src/behavior_rules.json",
+                 hypotheses_path: str = "src/feature_hypotheses.json",
+                 use_uplift: bool = True, max_batch_rows: int = MAX_BATCH_ROWS,
+                 max_wait_ms: float = MAX_WAIT_MS):
+        self.portraits = load_portraits(portraits_path)
+        self.portraits_rules = predictor.load_json(rules_path)
+        self.feature_hypotheses = predictor.load_json(hypotheses_path)
+        self.max_batch_rows = max_batch_rows
+        self.max_wait = max_wait_ms / 1000
+        self.models = {}
+        for f in self.feature_hypotheses:
+            name = f["feature_name"]
+            # только уже обученные модели с диска — сервис не обучает на лету
+            try:
+                self.models[name] = uplift.get_uplift_model(
+                    name, portraits_rules=self.portraits_rules,
+                    feature_hypotheses=self.feature_hypotheses) if use_uplift else None
+            except KeyError:
+                self.models[name] = None
+        self._queues = {}
+        self._lock = threading.Lock()
+        self._latencies = []
+        self._batches = 0
+
+    def _queue(self, feature_name: str):
+        with self._lock:
+            if feature_name not in self._queues:
+                predictor.infer_feature_info(
+                    self.feature_hypotheses, feature_name)
+                q = queue.Queue()
+                self._queues[feature_name] = q
+                threading.Thread(target=self._batcher, args=(feature_name, q),
+                                 daemon=True).start()
+            return self._queues[feature_name]
+
+    def _batcher(self, feature_name: str, q: queue.Queue):
+        while True:
+            batch = [q.get()]
+            rows = len(batch[0].clients)
+            deadline = time.perf_counter() + self.max_wait
+            while rows < self.max_batch_rows:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    req = q.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                batch.append(req)
+                rows += len(req.clients)
+            self._run_batch(feature_name, batch)
+
+    def _run_batch(self, feature_name: str, batch: list):
+        try:
+            clients = pd.concat([r.clients for r in batch], ignore_index=True)
+            forecast = self.forecast_frame(clients, feature_name)
+            offsets = np.cumsum([0] + [len(r.clients) for r in batch])
+            for r, start, end in zip(batch, offsets[:-1], offsets[1:]):
+                r.result = forecast.iloc[start:end]
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0].error = e
+            else:
+                # ошибка одного запроса не должна ронять соседей по батчу
+                for r in batch:
+                    try:
+                        r.result = self.forecast_frame(r.clients, feature_name)
+                    except Exception as req_error:
+                        r.error = req_error
+        with self._lock:
+            self._batches += 1
+        for r in batch:
+            r.batch_size = len(batch)
+            r.done.set()
+
+    def prepare(self, clients: list):
+        """
+        Проверить и дополнить клиентов одного запроса до постановки в очередь:
+        числовые колонки приводятся к числам, без portrait_name — сопоставление
+        с портретами, без client_id — номер строки в запросе.
+        Некорректный запрос — ValueError (HTTP 400), до батча он не доходит.
+        """
+        if not isinstance(clients, list) or not clients:
+            raise ValueError("Ожидается непустой список клиентов.")
+        if not all(isinstance(c, dict) for c in clients):
+            raise ValueError("Каждый клиент должен быть объектом с полями.")
+        df = pd.DataFrame(clients)
+        missing = [c for c in NUMERIC_COLS if c not in df.columns]
+        if missing:
+            raise ValueError(f"Не хватает полей: {', '.join(missing)}")
+        for col in NUMERIC_COLS:
+            df[col] = pd.to_numeric(df[col], errors="coerce")
+            if df[col].isna().any():
+                raise ValueError(f"Поле '{col}' должно быть числом у всех клиентов.")
+        if "portrait_name" not in df.columns:
+            df["portrait_name"] = assign_portraits(df, self.portraits)
+        if "client_id" not in df.columns:
+            df["client_id"] = df.index.astype(str)
+        return df
+
+    def forecast_frame(self, clients: pd.DataFrame, feature_name: str):
+        """
+        Векторный прогноз для батча клиентов (без очереди).
+        clients должны быть подготовлены prepare().
+        """
+        forecast, _ = predictor.run_behavior_forecast(
+            mapped_df=clients,
+            sim_df=None,
+            portraits_rules=self.portraits_rules,
+            feature_hypotheses=self.feature_hypotheses,
+            feature_name=feature_name,
+            train_model=False,
+            uplift_model=self.models.get(feature_name),
+        )
+        return forecast[FORECAST_COLS]
+
+    def forecast(self, clients: list, feature_name: str, timeout: float = 60):
+        """
+        Прогноз для списка клиентов (dict) через микро-батчер.
+        Возвращает (список прогнозов, latency_ms, число запросов в батче).
+        """
+        q = self._queue(feature_name)
+        req = _Request(self.prepare(clients))
+        q.put(req)
+        if not req.done.wait(timeout):
+            raise TimeoutError("Прогноз не успел посчитаться.")
+        if req.error is not None:
+            raise req.error
+        latency_ms = (time.perf_counter() - req.enqueued) * 1000
+        with self._lock:
+            self._latencies.append(latency_ms)
+            del self._latencies[:-10_000]
+        return req.result.to_dict(orient="records"), latency_ms, req.batch_size
+
+    def stats(self):
+        with self._lock:
+            lat = np.array(self._latencies)
+            batches = self._batches
+        if len(lat) == 0:
+            return {"requests": 0, "batches": batches}
+        return {
+            "requests": int(len(lat)),
+            "batches": batches,
+            "latency_ms_p50": float(np.percentile(lat, 50)),
+            "latency_ms_p95": float(np.percentile(lat, 95)),
+            "latency_ms_max": float(lat.max()),
+        }
+
+
+def make_handler(service: ForecastService):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, code: int, payload: dict):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._send(200, {"status": "ok",
+                                 "features": list(service.models.keys()),
+                                 "uplift_models": [k for k, v in service.models.items() if v is not None]})
+            elif self.path == "/stats":
+                self._send(200, service.stats())
+            else:
+                self._send(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path != "/forecast":
+                self._send(404, {"error": "not found"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                forecasts, latency_ms, batch_size = service.forecast(
+                    payload["clients"], payload["feature_name"])
+            except (KeyError, ValueError) as e:
+                self._send(400, {"error": str(e)})
+                return
+            except Exception as e:
+                self._send(500, {"error": str(e)})
+                return
+            self._send(200, {"forecasts": forecasts,
+                             "latency_ms": latency_ms,
+                             "batched_requests": batch_size})
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(host: str = "127.0.0.1", port: int = 8765, **service_kwargs):
+    service = ForecastService(**service_kwargs)
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    print(f"Forecast service on http://{host}:{port} (POST /forecast, GET /health, GET /stats)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Локальный сервис прогнозов АЗС TwinLab")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--max-wait-ms", type=float, default=MAX_WAIT_MS)
+    parser.add_argument("--max-batch-rows", type=int, default=MAX_BATCH_ROWS)
+    parser.add_argument("--no-uplift", action="store_true")
+    args = parser.parse_args()
+    serve(args.host, args.port, max_wait_ms=args.max_wait_ms,
+          max_batch_rows=args.max_batch_rows, use_uplift=not args.no_uplift)
@@ -0,0 +1,61 @@
+import argparse
+import json
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from generator import generate_clients
+
+# простой нагрузочный тест для serving.py:
+# N параллельных клиентов шлют батчи клиентов на POST /forecast
+
+
+def post_forecast(url: str, feature_name: str, clients: list):
+    body = json.dumps({"feature_name": feature_name,
+                      "clients": clients}, ensure_ascii=False).encode("utf-8")
+    req = urllib.request.Request(url, data=body, headers={
+                                 "Content-Type": "application/json"})
+    start = time.perf_counter()
+    with urllib.request.urlopen(req) as resp:
+        payload = json.loads(resp.read())
+    return (time.perf_counter() - start) * 1000, payload
+
+
+def run_load_test(host: str, port: int, feature_name: str, requests: int = 200,
+                  concurrency: int = 16, batch_size: int = 50):
+    url = f"http://{host}:{port}/forecast"
+    pool = generate_clients(max(batch_size * 4, 200))
+    pool = pool.drop(columns=["region"]).to_dict(orient="records")
+    batches = [[pool[(i * batch_size + j) % len(pool)] for j in range(batch_size)]
+               for i in range(requests)]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as ex:
+        results = list(ex.map(
+            lambda b: post_forecast(url, feature_name, b), batches))
+    total = time.perf_counter() - start
+
+    client_lat = np.array([r[0] for r in results])
+    server_lat = np.array([r[1]["latency_ms"] for r in results])
+    batched = np.array([r[1]["batched_requests"] for r in results])
+    print(f"Запросов: {requests}, параллельно: {concurrency}, клиентов в запросе: {batch_size}")
+    print(f"Пропускная способность: {requests / total:.1f} запр/с, "
+          f"{requests * batch_size / total:.0f} клиентов/с")
+    print(f"Латентность (клиент), мс: p50={np.percentile(client_lat, 50):.1f} "
+          f"p95={np.percentile(client_lat, 95):.1f} max={client_lat.max():.1f}")
+    print(f"Латентность (сервер), мс: p50={np.percentile(server_lat, 50):.1f} "
+          f"p95={np.percentile(server_lat, 95):.1f}")
+    print(f"Запросов в микро-батче: среднее={batched.mean():.1f} max={batched.max()}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Нагрузочный тест serving.py")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--feature", default="Скидка на топливо")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--batch-size", type=int, default=50)
+    args = parser.parse_args()
+    run_load_test(args.host, args.port, args.feature, args.requests,
+                  args.concurrency, args.batch_size)
@@ -0,0 +1,290 @@
+import os
+from multiprocessing import Pool
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+import pandas as pd
+import predictor
+from mapper import CAT_FEATURES, NUM_FEATURES, assign_portraits, fill_missing
+from instrumentation import instrument
+
+# колоночная передача данных между стадиями и процессами через shared memory:
+# каждая колонка — отдельный блок (numpy-буфер), строки/категории хранятся кодами int32.
+# Базовые колонки копируются в shared memory один раз, стадии читают их без копирования
+# и только дописывают свои колонки результатов.
+
+
+class SharedFrame:
+    """
+    Набор колонок в multiprocessing.shared_memory.
+    spec — маленький словарь (имена блоков, dtype, категории), его и передаём воркерам.
+    """
+
+    def __init__(self, spec: dict, blocks: dict, owned: set):
+        self.spec = spec
+        self._blocks = blocks
+        self._owned = owned
+
+    @property
+    def rows(self):
+        return self.spec["rows"]
+
+    @property
+    def columns(self):
+        return list(self.spec["columns"].keys())
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, columns: list = None):
+        """
+        Скопировать колонки df в shared memory (единственная копия базовых данных).
+        """
+        shared = cls({"rows": len(df), "columns": {}}, {}, set())
+        for col in columns or list(df.columns):
+            values = df[col]
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                shared._put(col, values.cat.codes.to_numpy(dtype=np.int32),
+                            list(values.cat.categories))
+            elif values.dtype.kind in "biuf":
+                shared._put(col, values.to_numpy())
+            else:
+                codes, categories = pd.factorize(values, sort=True)
+                shared._put(col, codes.astype(np.int32), list(categories))
+        return shared
+
+    @classmethod
+    def attach(cls, spec: dict):
+        """
+        Подключиться к уже созданным блокам (в воркере) — без копирования данных.
+        """
+        blocks = {col: SharedMemory(name=meta["shm"])
+                  for col, meta in spec["columns"].items()}
+        return cls(spec, blocks, set())
+
+    def _put(self, name: str, arr: np.ndarray, categories=None):
+        shm = SharedMemory(create=True, size=max(arr.nbytes, 1))
+        view = np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)
+        view[:] = arr
+        self._blocks[name] = shm
+        self._owned.add(name)
+        self.spec["columns"][name] = {"shm": shm.name, "dtype": arr.dtype.str,
+                                      "categories": categories}
+
+    def add_column(self, name: str, dtype=np.float64, fill=np.nan, categories=None):
+        """
+        Выделить новую колонку результатов (создаётся владельцем до запуска воркеров).
+        categories — для колонки кодов категорий (dtype int32, fill=-1).
+        Возвращает numpy-view для записи.
+        """
+        if name in self.spec["columns"]:
+            raise ValueError(f"Колонка '{name}' уже есть в SharedFrame.")
+        self._put(name, np.full(self.rows, fill, dtype=dtype), categories)
+        return self.column(name)
+
+    def column(self, name: str):
+        """
+        numpy-view колонки прямо в shared memory (для категорий — коды).
+        """
+        meta = self.spec["columns"][name]
+        return np.ndarray((self.rows,), dtype=np.dtype(meta["dtype"]),
+                          buffer=self._blocks[name].buf)
+
+    def series(self, name: str, start: int = 0, stop: int = None):
+        """
+        Колонка как pd.Series; категории — pd.Categorical поверх кодов.
+        """
+        meta = self.spec["columns"][name]
+        values = self.column(name)[start:stop]
+        if meta["categories"] is not None:
+            values = pd.Categorical.from_codes(values, meta["categories"])
+        return pd.Series(values, name=name, copy=False)
+
+    def to_frame(self, columns: list = None, start: int = 0, stop: int = None):
+        """
+        DataFrame по выбранным колонкам и диапазону строк.
+        pandas может склеить числовые колонки в один блок (копия) — для больших
+        таблиц лучше работать с column() напрямую.
+        """
+        return pd.DataFrame({c: self.series(c, start, stop) for c in columns or self.columns})
+
+    def close(self):
+        for shm in self._blocks.values():
+            shm.close()
+
+    def unlink(self):
+        """
+        Освободить блоки, созданные этим процессом.
+        """
+        self.close()
+        for name in self._owned:
+            self._blocks[name].unlink()
+        self._owned.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if self._owned:
+            self.unlink()
+        else:
+            self.close()
+
+
+def _run_chunks(worker, tasks, processes):
+    processes = processes or min(len(tasks), os.cpu_count() or 1) or 1
+    if processes == 1:
+        for task in tasks:
+            worker(task)
+    else:
+        with Pool(processes=processes) as pool:
+            pool.map(worker, tasks)
+
+
+def _bounds(rows: int, chunk_rows: int):
+    return [(s, min(s + chunk_rows, rows)) for s in range(0, rows, chunk_rows)]
+
+
+# === параллельный маппинг поверх SharedFrame ===
+
+MAPPING_INPUT_COLS = CAT_FEATURES + NUM_FEATURES
+UNDEFINED_PORTRAIT = "Неопределенный тип"
+
+
+def _assign_chunk(args):
+    # воркер: скоринг портретов построчный (нужен DataFrame) — собираем только свой
+    # диапазон строк, результат пишем кодами прямо в колонку portrait_name;
+    # числа уже заполнены владельцем, здесь заполняются только категории
+    spec, start, stop, portraits, num_means = args
+    shared = SharedFrame.attach(spec)
+    try:
+        part = shared.to_frame(MAPPING_INPUT_COLS, start, stop)
+        part[CAT_FEATURES] = part[CAT_FEATURES].astype(object)
+        part = fill_missing(part, num_means)
+        names = shared.spec["columns"]["portrait_name"]["categories"]
+        shared.column("portrait_name")[start:stop] = pd.Categorical(
+            assign_portraits(part, portraits), categories=names).codes
+    finally:
+        shared.close()
+    return stop - start
+
+
+@instrument("shared_frame.assign_portraits_shared")
+def assign_portraits_shared(shared: SharedFrame, portraits: list, processes: int = None,
+                            chunk_rows: int = 200_000):
+    """
+    Сопоставление с портретами (как map_clients_to_portraits, без кластеризации)
+    по клиентам в SharedFrame. Пропуски заполняются как в preprocess_data —
+    средними по всем клиентам. Дописывает колонку кодов portrait_name.
+    Вызывается владельцем до запуска воркеров следующих стадий.
+    Возвращает тот же SharedFrame.
+    """
+    num_means = {c: float(np.nanmean(shared.column(c))) for c in NUM_FEATURES}
+    # числовые пропуски заполняем один раз прямо в shared memory: следующие стадии
+    # (forecast_shared, portrait_totals) читают те же значения, что и map_clients_to_portraits
+    for c in NUM_FEATURES:
+        values = shared.column(c)
+        if values.dtype.kind == "f":
+            values[np.isnan(values)] = num_means[c]
+    names = sorted({p["portrait_name"] for p in portraits} | {UNDEFINED_PORTRAIT})
+    shared.add_column("portrait_name", dtype=np.int32, fill=-1, categories=names)
+    tasks = [(shared.spec, s, e, portraits, num_means)
+             for s, e in _bounds(shared.rows, chunk_rows)]
+    _run_chunks(_assign_chunk, tasks, processes)
+    return shared
+
+
+# === параллельный прогноз поверх SharedFrame ===
+
+FORECAST_INPUT_COLS = ["portrait_name", "visits_per_month", "avg_spend_per_visit"]
+FORECAST_OUTPUT_COLS = ["predicted_visits", "predicted_spend",
+                        "baseline_revenue", "predicted_revenue"]
+
+
+def _forecast_chunk(args):
+    # воркер: читает базовые колонки по view, пишет свой диапазон в колонки результатов
+    # вероятность считается по кодам портретов и view колонок, без сборки DataFrame
+    spec, start, stop, base_by_code, lifts = args
+    shared = SharedFrame.attach(spec)
+    try:
+        codes = shared.column("portrait_name")[start:stop]
+        visits = shared.column("visits_per_month")[start:stop].astype(float)
+        spend = shared.column("avg_spend_per_visit")[start:stop].astype(float)
+        prob = np.minimum(base_by_code[codes] +
+                          predictor.activity_from_arrays(visits, spend), 0.99)
+        rel_visits = np.clip(1.0 + prob * lifts["lift_visits"], 0.5, 5.0)
+        rel_spend = np.clip(1.0 + prob * lifts["lift_spend"], 0.7, 5.0)
+        shared.column("predicted_visits")[start:stop] = visits * rel_visits
+        shared.column("predicted_spend")[start:stop] = spend * rel_spend
+        shared.column("baseline_revenue")[start:stop] = visits * spend
+        shared.column("predicted_revenue")[start:stop] = \
+            visits * rel_visits * spend * rel_spend
+    finally:
+        shared.close()
+    return stop - start
+
+
+@instrument("shared_frame.forecast_shared")
+def forecast_shared(shared: SharedFrame, portraits_rules: dict, feature_hypotheses: list,
+                    feature_name: str, processes: int = None, chunk_rows: int = 500_000):
+    """
+    Closed-form прогноз (как run_behavior_forecast без моделей) по клиентам в SharedFrame.
+    Воркеры получают только spec, читают колонки без копирования и дописывают
+    predicted_visits, predicted_spend, baseline_revenue, predicted_revenue.
+    Возвращает тот же SharedFrame.
+    """
+    feature_info = predictor.infer_feature_info(
+        feature_hypotheses, feature_name)
+    lifts = predictor.resolve_lifts(feature_info)
+    # базовые вероятности по кодам портретов — один маленький массив на все воркеры
+    base_by_code = predictor.base_probs_by_code(
+        shared.spec["columns"]["portrait_name"]["categories"],
+        portraits_rules, feature_info.get("target_metric"))
+    for col in FORECAST_OUTPUT_COLS:
+        if col not in shared.spec["columns"]:
+            shared.add_column(col)
+
+    tasks = [(shared.spec, s, e, base_by_code, lifts)
+             for s, e in _bounds(shared.rows, chunk_rows)]
+    _run_chunks(_forecast_chunk, tasks, processes)
+    return shared
+
+
+def portrait_totals(shared: SharedFrame):
+    """
+    Агрегат по портретам из колонок SharedFrame (bincount по кодам портретов).
+    """
+    codes = shared.column("portrait_name")
+    names = shared.spec["columns"]["portrait_name"]["categories"]
+    valid = codes >= 0
+    n = len(names)
+
+    def total(col):
+        return np.bincount(codes[valid], weights=np.nan_to_num(shared.column(col)[valid]),
+                           minlength=n)
+
+    agg = pd.DataFrame({
+        "portrait_name": names,
+        "clients_count": np.bincount(codes[valid], minlength=n),
+        "baseline_visits": total("visits_per_month"),
+        "predicted_visits": total("predicted_visits"),
+        "baseline_revenue": total("baseline_revenue"),
+        "predicted_revenue": total("predicted_revenue"),
+    })
+    agg = agg[agg["clients_count"] > 0].reset_index(drop=True)
+    return predictor.add_change_columns(agg)
+
+
+@instrument("shared_frame.map_and_forecast_shared")
+def map_and_forecast_shared(clients_df: pd.DataFrame, portraits: list, portraits_rules: dict,
+                            feature_hypotheses: list, feature_name: str,
+                            processes: int = None):
+    """
+    Маппинг и прогноз одной передачей данных: колонки клиентов один раз копируются
+    в shared memory, стадия маппинга дописывает portrait_name, стадия прогноза
+    читает его оттуда же и дописывает свои колонки.
+    Возвращает агрегат по портретам (как portrait_totals).
+    """
+    columns = list(dict.fromkeys(MAPPING_INPUT_COLS + FORECAST_INPUT_COLS[1:]))
+    with SharedFrame.from_frame(clients_df, columns) as shared:
+        assign_portraits_shared(shared, portraits, processes=processes)
+        forecast_shared(shared, portraits_rules, feature_hypotheses, feature_name,
+                        processes=processes)
+        return portrait_totals(shared)
@@ -4,6 +4,7 @@ import numpy as np
 from sklearn.preprocessing import StandardScaler
 from sklearn.cluster import KMeans
 from sklearn.ensemble import RandomForestClassifier
+from instrumentation import instrument, stage
 
 # загрузка данных
 
@@ -15,27 +16,12 @@ def load_json(path: str):
 # генерация откликов
 
 
-def simulate_feature_response(clients_df: pd.DataFrame,
-                              portraits_rules: dict,
-                              feature_hypotheses: list,
-                              selected_feature: str):
+def simulate_responses(df: pd.DataFrame, portraits_rules: dict,
+                       target_metric: str, applicable_portraits: list):
     """
-    Симуляция реакции клиентов на выбранную фичу.
-    Возвращает датафрейм с откликами и статистикой по портретам.
+    Бинарные отклики (0/1) клиентов df по правилам портретов.
+    Возвращает список откликов в порядке строк df.
     """
-    df = clients_df.copy()
-
-    # найдем гипотезу
-    feature = next(
-        (f for f in feature_hypotheses if f["feature_name"] == selected_feature), None)
-    if feature is None:
-        raise ValueError(
-            f"Feature {selected_feature} not found in hypotheses.")
-
-    target_metric = feature["target_metric"]
-    applicable_portraits = feature["applicable_to"]
-
-    # добавим колонку "реакция" (0-1)
     responses = []
     for idx, row in df.iterrows():
         portrait = row.get("portrait_name")
@@ -53,20 +39,55 @@ def simulate_feature_response(clients_df: pd.DataFrame,
         response = np.random.binomial(
             1, prob) if portrait in applicable_portraits else 0
         responses.append(response)
+    return responses
 
-    df[f"response_to_{selected_feature}"] = responses
-
-    # кластеризация по отклику для визуализации паттернов
-    scaler = StandardScaler()
-    num_features = ["visits_per_month",
-                    "avg_liters_per_visit", "avg_spend_per_visit"]
-    scaled = scaler.fit_transform(df[num_features])
-    kmeans = KMeans(n_clusters=min(8, len(df)//50), random_state=42)
-    df["response_cluster"] = kmeans.fit_predict(scaled)
 
-    # метрики по портретам
-    metrics = df.groupby("portrait_name")[f"response_to_{selected_feature}"].agg([
+def response_metrics(df: pd.DataFrame, response_col: str):
+    """
+    Метрики отклика по портретам: response_rate, total_responses, total_clients.
+    """
+    return df.groupby("portrait_name")[response_col].agg([
         "mean", "sum", "count"
     ]).rename(columns={"mean": "response_rate", "sum": "total_responses", "count": "total_clients"}).reset_index()
 
+
+@instrument("simulator.simulate_feature_response")
+def simulate_feature_response(clients_df: pd.DataFrame,
+                              portraits_rules: dict,
+                              feature_hypotheses: list,
+                              selected_feature: str):
+    """
+    Симуляция реакции клиентов на выбранную фичу.
+    Возвращает датафрейм с откликами и статистикой по портретам.
+    """
+    # поверхностная копия: базовые колонки общие с clients_df, новые добавляются только в df
+    df = clients_df.copy(deep=False)
+
+    # найдем гипотезу
+    feature = next(
+        (f for f in feature_hypotheses if f["feature_name"] == selected_feature), None)
+    if feature is None:
+        raise ValueError(
+            f"Feature {selected_feature} not found in hypotheses.")
+
+    target_metric = feature["target_metric"]
+    applicable_portraits = feature["applicable_to"]
+
+    with stage("simulator.responses", rows_in=len(df)):
+        # добавим колонку "реакция" (0-1)
+        df[f"response_to_{selected_feature}"] = simulate_responses(
+            df, portraits_rules, target_metric, applicable_portraits)
+
+    with stage("simulator.response_clustering", rows_in=len(df)):
+        # кластеризация по отклику для визуализации паттернов
+        scaler = StandardScaler()
+        num_features = ["visits_per_month",
+                        "avg_liters_per_visit", "avg_spend_per_visit"]
+        scaled = scaler.fit_transform(df[num_features])
+        kmeans = KMeans(n_clusters=min(8, len(df)//50), random_state=42)
+        df["response_cluster"] = kmeans.fit_predict(scaled)
+
+    # метрики по портретам
+    metrics = response_metrics(df, f"response_to_{selected_feature}")
+
     return df, metrics
@@ -0,0 +1,361 @@
+import numpy as np
+import pandas as pd
+
+# потоковые приближённые агрегаты: обновляются по чанкам и сливаются между воркерами.
+# состояние — килобайты вместо полного сканирования таблицы.
+
+_HASH_KEY = "azs-twinlab-skch"   # hash_key для pd.util.hash_array — ровно 16 символов
+_MASK32 = np.uint64(0xFFFFFFFF)
+# без этих колонок RegionPortraitSketch не собрать
+REQUIRED_COLUMNS = ("region", "portrait_name", "client_id")
+
+
+def hash_keys(values):
+    """
+    Детерминированный 64-битный хэш значений (строк, чисел) — одинаковый во всех процессах.
+    """
+    return pd.util.hash_array(np.asarray(values, dtype=object), hash_key=_HASH_KEY)
+
+
+def _bit_length(x: np.ndarray):
+    # длина в битах для uint64 (0 -> 0), точно — через две 32-битные половины
+    hi = (x >> np.uint64(32)).astype(np.float64)
+    lo = (x & _MASK32).astype(np.float64)
+    with np.errstate(divide="ignore"):
+        bl_hi = np.where(hi > 0, np.floor(np.log2(hi)) + 1, 0)
+        bl_lo = np.where(lo > 0, np.floor(np.log2(lo)) + 1, 0)
+    return np.where(hi > 0, bl_hi + 32, bl_lo).astype(np.int64)
+
+
+class CountMinSketch:
+    """
+    Count-Min: оценка суммы весов по ключу (только неотрицательные веса).
+    Оценка не меньше истинной; ошибка <= e/width * общий вес с вероятностью 1 - exp(-depth).
+    """
+
+    def __init__(self, width: int = 2048, depth: int = 4):
+        self.width = width
+        self.depth = depth
+        self.table = np.zeros((depth, width), dtype=np.float64)
+        self.total = 0.0
+
+    def _indexes(self, keys):
+        h = hash_keys(keys)
+        h1 = h & _MASK32
+        h2 = (h >> np.uint64(32)) | np.uint64(1)
+        rows = np.arange(self.depth, dtype=np.uint64)[:, None]
+        return ((h1[None, :] + rows * h2[None, :]) % np.uint64(self.width)).astype(np.int64)
+
+    def update(self, keys, weights=None):
+        keys = np.asarray(keys, dtype=object)
+        if len(keys) == 0:
+            return self
+        weights = np.ones(len(keys)) if weights is None else np.asarray(
+            weights, dtype=np.float64)
+        if (weights < 0).any():
+            raise ValueError("CountMinSketch принимает только неотрицательные веса.")
+        idx = self._indexes(keys)
+        for row in range(self.depth):
+            np.add.at(self.table[row], idx[row], weights)
+        self.total += float(weights.sum())
+        return self
+
+    def query(self, keys):
+        keys = np.asarray(keys, dtype=object)
+        idx = self._indexes(keys)
+        return self.table[np.arange(self.depth)[:, None], idx].min(axis=0)
+
+    def merge(self, other: "CountMinSketch"):
+        if (self.width, self.depth) != (other.width, other.depth):
+            raise ValueError("Нельзя слить Count-Min с разными размерами.")
+        self.table += other.table
+        self.total += other.total
+        return self
+
+    @property
+    def nbytes(self):
+        return self.table.nbytes
+
+
+class KLLSketch:
+    """
+    KLL-скетч квантилей: уровни-компакторы, элемент уровня h весит 2**h.
+    Ранговая ошибка порядка 1/k.
+    """
+
+    def __init__(self, k: int = 200, seed: int = 42):
+        self.k = k
+        self.levels = [np.empty(0)]
+        self.count = 0
+        self._rng = np.random.default_rng(seed)
+
+    def _capacity(self, h: int):
+        depth = len(self.levels) - h - 1
+        return max(int(np.ceil(self.k * (2 / 3) ** depth)), 2)
+
+    def _compress(self):
+        h = 0
+        while h < len(self.levels):
+            level = self.levels[h]
+            if len(level) > self._capacity(h):
+                if h + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                level = np.sort(level)
+                # нечётный элемент остаётся на уровне
+                keep = level[-1:] if len(level) % 2 else level[:0]
+                pairs = level[:len(level) - len(keep)]
+                promoted = pairs[self._rng.integers(2)::2]
+                self.levels[h] = keep
+                self.levels[h + 1] = np.concatenate(
+                    [self.levels[h + 1], promoted])
+            h += 1
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return self
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self.count += len(values)
+        self._compress()
+        return self
+
+    def merge(self, other: "KLLSketch"):
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for h, level in enumerate(other.levels):
+            self.levels[h] = np.concatenate([self.levels[h], level])
+        self.count += other.count
+        self._compress()
+        return self
+
+    def quantile(self, q):
+        """
+        Квантиль(и) q из [0, 1]; для пустого скетча — NaN.
+        """
+        items = np.concatenate(self.levels)
+        if len(items) == 0:
+            return np.full(np.shape(q), np.nan) if np.ndim(q) else float("nan")
+        weights = np.concatenate(
+            [np.full(len(level), 2.0 ** h) for h, level in enumerate(self.levels)])
+        order = np.argsort(items, kind="stable")
+        items, cum = items[order], np.cumsum(weights[order])
+        pos = np.searchsorted(cum, np.asarray(q) * cum[-1], side="left")
+        return items[np.minimum(pos, len(items) - 1)]
+
+    @property
+    def nbytes(self):
+        return sum(level.nbytes for level in self.levels)
+
+
+class HyperLogLog:
+    """
+    HyperLogLog: оценка числа различных ключей, относительная ошибка ~1.04/sqrt(2**p).
+    """
+
+    def __init__(self, p: int = 12):
+        self.p = p
+        self.m = 1 << p
+        self.registers = np.zeros(self.m, dtype=np.uint8)
+
+    def update(self, keys):
+        keys = np.asarray(keys, dtype=object)
+        if len(keys) == 0:
+            return self
+        h = hash_keys(keys)
+        idx = (h >> np.uint64(64 - self.p)).astype(np.int64)
+        rest = h & np.uint64((1 << (64 - self.p)) - 1)
+        rank = (64 - self.p) - _bit_length(rest) + 1
+        np.maximum.at(self.registers, idx, rank.astype(np.uint8))
+        return self
+
+    def merge(self, other: "HyperLogLog"):
+        if self.p != other.p:
+            raise ValueError("Нельзя слить HyperLogLog с разной точностью.")
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def estimate(self):
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        raw = alpha * self.m ** 2 / \
+            np.sum(2.0 ** -self.registers.astype(np.float64))
+        zeros = int((self.registers == 0).sum())
+        if raw <= 2.5 * self.m and zeros:
+            # поправка для малых значений (linear counting)
+            return self.m * np.log(self.m / zeros)
+        return float(raw)
+
+    @property
+    def nbytes(self):
+        return self.registers.nbytes
+
+
+# === агрегаты регион × портрет ===
+
+
+def missing_columns(columns):
+    """
+    Каких обязательных колонок (REQUIRED_COLUMNS) нет среди columns.
+    """
+    return [c for c in REQUIRED_COLUMNS if c not in set(columns)]
+
+
+class RegionPortraitSketch:
+    """
+    Набор скетчей для дашборда регион × портрет:
+    - Count-Min: число клиентов, откликнувшихся, baseline/predicted выручка по ключу регион|портрет
+    - KLL: квантили визитов и среднего чека по портретам
+    - HyperLogLog: число различных клиентов (всего и по портретам)
+    - кандидаты в топ ключей (для вывода таблицы без полного списка регионов)
+    """
+
+    def __init__(self, width: int = 4096, depth: int = 4, k: int = 200, p: int = 12,
+                 top_k: int = 200):
+        self.params = {"width": width, "depth": depth, "k": k, "p": p}
+        self.top_k = top_k
+        self.counts = {name: CountMinSketch(width, depth) for name in
+                       ("clients", "responses", "baseline_revenue", "predicted_revenue")}
+        self.quantiles = {}      # (portrait, признак) -> KLLSketch
+        self.distinct = {}       # портрет или "__all__" -> HyperLogLog
+        self.candidates = set()
+        self.seen = set()        # какие счётчики реально получали данные
+
+    def _kll(self, portrait, feature):
+        key = (portrait, feature)
+        if key not in self.quantiles:
+            self.quantiles[key] = KLLSketch(self.params["k"])
+        return self.quantiles[key]
+
+    def _hll(self, portrait):
+        if portrait not in self.distinct:
+            self.distinct[portrait] = HyperLogLog(self.params["p"])
+        return self.distinct[portrait]
+
+    def _prune(self):
+        if len(self.candidates) <= self.top_k:
+            return
+        keys = np.array(sorted(self.candidates), dtype=object)
+        est = self.counts["clients"].query(keys)
+        self.candidates = set(keys[np.argsort(-est)[:self.top_k]])
+
+    def update(self, chunk: pd.DataFrame, response_col: str = None):
+        """
+        Обновить скетчи чанком клиентов.
+        Ожидаются колонки region, portrait_name, client_id, visits_per_month, avg_spend_per_visit;
+        если есть baseline_revenue / predicted_revenue (прогноз) и response_col — учитываются тоже.
+        """
+        missing = missing_columns(chunk.columns)
+        if missing:
+            raise ValueError(
+                f"Для скетчей регион × портрет не хватает колонок: {', '.join(missing)}")
+        keys = (chunk["region"].astype(str) + "|" +
+                chunk["portrait_name"].astype(str)).to_numpy(dtype=object)
+        self.counts["clients"].update(keys)
+        if response_col and response_col in chunk.columns:
+            self.counts["responses"].update(
+                keys, chunk[response_col].fillna(0).clip(lower=0).to_numpy())
+            self.seen.add("responses")
+        for name in ("baseline_revenue", "predicted_revenue"):
+            if name in chunk.columns:
+                self.counts[name].update(
+                    keys, chunk[name].fillna(0).clip(lower=0).to_numpy())
+                self.seen.add(name)
+
+        self._hll("__all__").update(chunk["client_id"].to_numpy())
+        for portrait, part in chunk.groupby("portrait_name"):
+            self._hll(portrait).update(part["client_id"].to_numpy())
+            for feature in ("visits_per_month", "avg_spend_per_visit"):
+                if feature in part.columns:
+                    self._kll(portrait, feature).update(part[feature].to_numpy())
+
+        top = pd.Series(keys).value_counts().index[:self.top_k]
+        self.candidates |= set(top)
+        self._prune()
+        return self
+
+    def merge(self, other: "RegionPortraitSketch"):
+        if self.params != other.params:
+            raise ValueError("Нельзя слить скетчи с разными параметрами.")
+        for name, cms in other.counts.items():
+            self.counts[name].merge(cms)
+        for key, kll in other.quantiles.items():
+            self._kll(*key).merge(kll)
+        for portrait, hll in other.distinct.items():
+            self._hll(portrait).merge(hll)
+        self.candidates |= other.candidates
+        self.seen |= other.seen
+        self._prune()
+        return self
+
+    def region_table(self, top: int = 50):
+        """
+        Оценки по топ-ключам регион × портрет: клиенты, доля откликов, изменение выручки.
+        Доля откликов и изменение выручки выводятся, только если в скетч попадали
+        отклики (response_col) и выручка (baseline/predicted_revenue) — иначе там были бы нули.
+        """
+        with_responses = "responses" in self.seen
+        with_revenue = {"baseline_revenue", "predicted_revenue"} <= self.seen
+        columns = ["region", "portrait_name", "clients_est"] + \
+            (["response_rate_est"] if with_responses else []) + \
+            (["revenue_change_est"] if with_revenue else [])
+        keys = np.array(sorted(self.candidates), dtype=object)
+        if len(keys) == 0:
+            return pd.DataFrame(columns=columns)
+        clients = self.counts["clients"].query(keys)
+        region, portrait = zip(*(k.split("|", 1) for k in keys))
+        table = pd.DataFrame({
+            "region": region,
+            "portrait_name": portrait,
+            "clients_est": clients,
+        })
+        if with_responses:
+            responses = self.counts["responses"].query(keys)
+            table["response_rate_est"] = np.minimum(responses / np.maximum(clients, 1), 1.0)
+        if with_revenue:
+            table["revenue_change_est"] = self.counts["predicted_revenue"].query(keys) - \
+                self.counts["baseline_revenue"].query(keys)
+        return table.sort_values("clients_est", ascending=False).head(top).reset_index(drop=True)
+
+    def portrait_table(self, quantiles=(0.25, 0.5, 0.75)):
+        """
+        Квантили визитов/чека и число различных клиентов по портретам.
+        """
+        rows = []
+        for portrait in sorted(p for p in self.distinct if p != "__all__"):
+            row = {"portrait_name": portrait,
+                   "distinct_clients_est": self.distinct[portrait].estimate()}
+            for feature in ("visits_per_month", "avg_spend_per_visit"):
+                if (portrait, feature) in self.quantiles:
+                    values = self.quantiles[(portrait, feature)].quantile(
+                        np.array(quantiles))
+                    for q, v in zip(quantiles, values):
+                        row[f"{feature}_q{int(round(q * 100))}"] = v
+            rows.append(row)
+        return pd.DataFrame(rows)
+
+    def distinct_clients(self):
+        return self._hll("__all__").estimate()
+
+    @property
+    def nbytes(self):
+        return (sum(c.nbytes for c in self.counts.values())
+                + sum(q.nbytes for q in self.quantiles.values())
+                + sum(h.nbytes for h in self.distinct.values()))
+
+
+def iter_chunks(df: pd.DataFrame, chunk_size: int = 100_000):
+    """
+    Разбить DataFrame на чанки (для pd.read_csv(..., chunksize=...) это не нужно).
+    """
+    for start in range(0, len(df), chunk_size):
+        yield df.iloc[start:start + chunk_size]
+
+
+def build_region_sketch(chunks, response_col: str = None, **params):
+    """
+    Собрать RegionPortraitSketch по итератору чанков.
+    """
+    sketch = RegionPortraitSketch(**params)
+    for chunk in chunks:
+        sketch.update(chunk, response_col=response_col)
+    return sketch
@@ -0,0 +1,241 @@
+import os
+import glob
+import json
+import pickle
+import hashlib
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.preprocessing import OneHotEncoder
+from sklearn.model_selection import train_test_split
+from sklearn.metrics import mean_absolute_error
+import predictor
+from incremental import record_dependencies
+from instrumentation import instrument, stage, record_metric
+
+MODELS_DIR = "data/models"
+FEAT_NUM = ["visits_per_month", "avg_liters_per_visit", "avg_spend_per_visit"]
+
+# === Монте-Карло: treated / control post-метрики ===
+
+
+def simulation_response_probs(df: pd.DataFrame, portraits_rules: dict,
+                              target_metric: str, applicable_portraits: list):
+    """
+    Векторная вероятность отклика как в simulator_advanced.simulate_responses:
+    base (0.05 по умолчанию) + 0.5 * среднее(визиты/10, чек/10000), 0 для неподходящих портретов.
+    """
+    bases = {p: float(r.get(target_metric, 0.05))
+             for p, r in portraits_rules.items()}
+    base = df["portrait_name"].map(bases).fillna(0.05).to_numpy(dtype=float)
+    visits = np.minimum(df["visits_per_month"].to_numpy(dtype=float) / 10, 1)
+    spend = np.minimum(df["avg_spend_per_visit"].to_numpy(dtype=float) / 10000, 1)
+    prob = np.minimum(base + 0.5 * (visits + spend) / 2, 1.0)
+    return np.where(df["portrait_name"].isin(applicable_portraits), prob, 0.0)
+
+
+@instrument("uplift.simulate_post_metrics")
+def simulate_post_metrics(clients_df: pd.DataFrame, portraits_rules: dict,
+                          feature_hypotheses: list, feature_name: str,
+                          n_runs: int = 1, treat_share: float = 0.5,
+                          noise: float = 0.05, seed: int = 42):
+    """
+    Монте-Карло A/B: каждый клиент случайно попадает в treated/control,
+    откликнувшиеся treated получают lift визитов и чека, всем добавляется шум.
+    n_runs повторов складываются в один DataFrame (колонка run).
+
+    Возвращает DataFrame: client_id, portrait_name, признаки, treated, response,
+    visits_post, spend_post.
+    """
+    rng = np.random.default_rng(seed)
+    feature_info = predictor.infer_feature_info(
+        feature_hypotheses, feature_name)
+    lifts = predictor.resolve_lifts(feature_info)
+    prob = simulation_response_probs(
+        clients_df, portraits_rules, feature_info["target_metric"],
+        feature_info.get("applicable_to", []))
+
+    base_cols = [c for c in ["client_id", "portrait_name"] + FEAT_NUM
+                 if c in clients_df.columns]
+    visits = clients_df["visits_per_month"].to_numpy(dtype=float)
+    spend = clients_df["avg_spend_per_visit"].to_numpy(dtype=float)
+    n = len(clients_df)
+
+    runs = []
+    for run in range(n_runs):
+        treated = rng.random(n) < treat_share
+        response = treated & (rng.random(n) < prob)
+        out = clients_df[base_cols].reset_index(drop=True)
+        out["run"] = run
+        out["treated"] = treated.astype(int)
+        out["response"] = response.astype(int)
+        out["visits_post"] = visits * (1 + response * lifts["lift_visits"]) * \
+            rng.lognormal(0, noise, n)
+        out["spend_post"] = spend * (1 + response * lifts["lift_spend"]) * \
+            rng.lognormal(0, noise, n)
+        runs.append(out)
+    return pd.concat(runs, ignore_index=True)
+
+# === модель ===
+
+
+class UpliftModel:
+    """
+    T-learner: по паре компактных лесов (treated / control) на относительные
+    визиты и чек. predict_relative даёт множители post / pre при запуске фичи.
+    """
+
+    def __init__(self, feature_name: str, n_estimators: int = 50, max_depth: int = 8,
+                 min_samples_leaf: int = 20):
+        self.feature_name = feature_name
+        self.params = {"n_estimators": n_estimators, "max_depth": max_depth,
+                       "min_samples_leaf": min_samples_leaf, "random_state": 42}
+        self.encoder = OneHotEncoder(
+            sparse_output=False, handle_unknown="ignore")
+        self.models = {}
+        self.metrics = {}
+        # ключ гипотезы и правил, на которых обучена модель (см. dependency_key)
+        self.deps_key = None
+
+    def _features(self, df: pd.DataFrame, fit: bool = False):
+        num = np.column_stack([
+            df[c].to_numpy(dtype=float) if c in df.columns else np.zeros(len(df))
+            for c in FEAT_NUM])
+        portraits = df[["portrait_name"]].fillna("Неопределенный тип")
+        cat = self.encoder.fit_transform(
+            portraits) if fit else self.encoder.transform(portraits)
+        return np.hstack([num, cat])
+
+    def fit(self, sim_post: pd.DataFrame):
+        X = self._features(sim_post, fit=True)
+        treated = sim_post["treated"].to_numpy() == 1
+        targets = {
+            "visits": sim_post["visits_post"].to_numpy(dtype=float) /
+            (sim_post["visits_per_month"].to_numpy(dtype=float) + 1e-6),
+            "spend": sim_post["spend_post"].to_numpy(dtype=float) /
+            (sim_post["avg_spend_per_visit"].to_numpy(dtype=float) + 1e-6),
+        }
+        for target, y in targets.items():
+            for arm, mask in (("treated", treated), ("control", ~treated)):
+                X_train, X_val, y_train, y_val = train_test_split(
+                    X[mask], y[mask], test_size=0.2, random_state=42)
+                model = RandomForestRegressor(**self.params)
+                model.fit(X_train, y_train)
+                mae = mean_absolute_error(y_val, model.predict(X_val))
+                self.models[(target, arm)] = model
+                self.metrics[f"{target}_{arm}_mae"] = float(mae)
+                record_metric(f"{target}_{arm}_mae", float(mae))
+        return self
+
+    def predict_relative(self, df: pd.DataFrame):
+        """
+        Множители (rel_visits, rel_spend) = 1 + (treated - control) для каждого клиента.
+        """
+        X = self._features(df)
+        rel = []
+        for target in ("visits", "spend"):
+            uplift = self.models[(target, "treated")].predict(X) - \
+                self.models[(target, "control")].predict(X)
+            rel.append(1.0 + uplift)
+        return rel[0], rel[1]
+
+    def predict(self, df: pd.DataFrame):
+        """
+        Прогноз на батч клиентов: baseline / predicted визиты и чек.
+        """
+        rel_visits, rel_spend = self.predict_relative(df)
+        out = pd.DataFrame({"client_id": df["client_id"].to_numpy()}) \
+            if "client_id" in df.columns else pd.DataFrame(index=range(len(df)))
+        out["baseline_visits"] = df["visits_per_month"].to_numpy(dtype=float)
+        out["baseline_spend"] = df["avg_spend_per_visit"].to_numpy(dtype=float)
+        out["predicted_visits"] = out["baseline_visits"] * \
+            np.clip(rel_visits, 0.5, 5.0)
+        out["predicted_spend"] = out["baseline_spend"] * \
+            np.clip(rel_spend, 0.7, 5.0)
+        return out
+
+
+@instrument("uplift.train_uplift_model")
+def train_uplift_model(clients_df: pd.DataFrame, portraits_rules: dict,
+                       feature_hypotheses: list, feature_name: str,
+                       n_runs: int = 1, max_rows: int = 200_000, seed: int = 42):
+    """
+    Симулировать treated/control и обучить UpliftModel для фичи.
+    max_rows: обучающая выборка ограничивается — модель компактная, миллионы строк не нужны.
+    """
+    sim_post = simulate_post_metrics(clients_df, portraits_rules, feature_hypotheses,
+                                     feature_name, n_runs=n_runs, seed=seed)
+    if len(sim_post) > max_rows:
+        sim_post = sim_post.sample(n=max_rows, random_state=seed)
+    with stage("uplift.fit", rows_in=len(sim_post)):
+        model = UpliftModel(feature_name).fit(sim_post)
+    model.deps_key = dependency_key(
+        portraits_rules, feature_hypotheses, feature_name)
+    return model
+
+# === хранение и тёплый кэш ===
+
+
+_cache = {}   # (feature_name, deps_key) -> UpliftModel
+
+
+def dependency_key(portraits_rules: dict, feature_hypotheses: list, feature_name: str):
+    """
+    Короткий хэш записи гипотезы и правил target_metric по портретам.
+    Поменялись правила или гипотеза — меняется ключ, и модель обучается заново.
+    """
+    deps = record_dependencies(
+        portraits_rules, feature_hypotheses, feature_name, portraits_rules.keys())
+    payload = json.dumps(deps, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:12]
+
+
+def model_path(feature_name: str, deps_key: str, models_dir: str = MODELS_DIR):
+    return os.path.join(models_dir, f"uplift_{feature_name}_{deps_key}.pkl")
+
+
+def save_uplift_model(model: UpliftModel, models_dir: str = MODELS_DIR):
+    """
+    Сохранить модель; модели этой фичи под старыми ключами удаляются.
+    """
+    os.makedirs(models_dir, exist_ok=True)
+    path = model_path(model.feature_name, model.deps_key, models_dir)
+    for old in glob.glob(model_path(glob.escape(model.feature_name), "*", models_dir)):
+        if old != path:
+            os.remove(old)
+    with open(path, "wb") as f:
+        pickle.dump(model, f)
+    return path
+
+
+def load_uplift_model(feature_name: str, deps_key: str, models_dir: str = MODELS_DIR):
+    with open(model_path(feature_name, deps_key, models_dir), "rb") as f:
+        return pickle.load(f)
+
+
+def get_uplift_model(feature_name: str, clients_df: pd.DataFrame = None,
+                     portraits_rules: dict = None, feature_hypotheses: list = None,
+                     models_dir: str = MODELS_DIR):
+    """
+    Модель из памяти процесса, иначе с диска, иначе обучаем на clients_df и сохраняем.
+    Модель ищется по фиче и dependency_key(правила, гипотезы): после правки
+    правил или гипотезы старая модель не подходит и обучается новая.
+    """
+    if portraits_rules is None or feature_hypotheses is None:
+        raise ValueError("Для поиска uplift-модели нужны правила и гипотезы.")
+    deps_key = dependency_key(portraits_rules, feature_hypotheses, feature_name)
+    key = (feature_name, deps_key)
+    if key in _cache:
+        return _cache[key]
+    if os.path.exists(model_path(feature_name, deps_key, models_dir)):
+        model = load_uplift_model(feature_name, deps_key, models_dir)
+    elif clients_df is not None:
+        model = train_uplift_model(
+            clients_df, portraits_rules, feature_hypotheses, feature_name)
+        save_uplift_model(model, models_dir)
+    else:
+        raise KeyError(
+            f"Uplift-модель для '{feature_name}' под текущие правила не найдена, "
+            "а данных для обучения нет.")
+    _cache[key] = model
+    return model
@@ -2,24 +2,68 @@ import pandas as pd
 import plotly.express as px
 import plotly.figure_factory as ff
 
+# квантили, которые храним в сводке по портретам
+SUMMARY_QUANTILES = (0.25, 0.5, 0.75)
+# максимум точек для scatter / распределений — дальше сэмплируем
+MAX_POINTS = 5000
 
-def plot_portrait_distribution(df: pd.DataFrame):
+
+def build_portrait_summary(df: pd.DataFrame, features: list, quantiles=SUMMARY_QUANTILES):
+    """
+    Сводка (куб) по портретам: один groupby на весь датасет.
+    Колонки — MultiIndex (признак, статистика): mean, sum, count, q25, q50, q75.
+    Отдельно ("clients", "count") — число клиентов в портрете.
+    Строится один раз на смапленный датасет и передаётся во все графики.
+    """
+    g = df.groupby('portrait_name')[features]
+    stats = g.agg(['mean', 'sum', 'count'])
+    q = g.quantile(list(quantiles)).unstack()
+    q.columns = pd.MultiIndex.from_tuples(
+        [(f, f"q{int(round(v * 100))}") for f, v in q.columns])
+    summary = pd.concat([stats, q], axis=1)
+    summary[("clients", "count")] = g.size()
+    return summary
+
+
+def downsample(df: pd.DataFrame, max_points: int = MAX_POINTS, by: str = 'portrait_name',
+               random_state: int = 42):
+    """
+    Стратифицированная выборка не больше max_points строк (пропорционально портретам),
+    чтобы стоимость отрисовки не зависела от размера популяции.
+    """
+    if len(df) <= max_points:
+        return df
+    frac = max_points / len(df)
+    if by in df.columns:
+        return df.groupby(by, group_keys=False).sample(frac=frac, random_state=random_state)
+    return df.sample(n=max_points, random_state=random_state)
+
+
+def plot_portrait_distribution(df: pd.DataFrame, summary: pd.DataFrame = None):
     """
     Распределение клиентов по портретам.
     """
-    counts = df['portrait_name'].value_counts().reset_index()
+    if summary is not None:
+        counts = summary[("clients", "count")].sort_values(
+            ascending=False).reset_index()
+    else:
+        counts = df['portrait_name'].value_counts().reset_index()
     counts.columns = ['Портрет', 'Количество клиентов']
     fig = px.bar(counts, x='Портрет', y='Количество клиентов',
                  title='Распределение клиентов по портретам')
     return fig
 
 
-def plot_heatmap_features(df: pd.DataFrame, features: list, feature_names: dict):
+def plot_heatmap_features(df: pd.DataFrame, features: list, feature_names: dict,
+                          summary: pd.DataFrame = None):
     """
     Тепловая карта средних значений признаков по портретам.
     feature_names: словарь вида {"visits_per_month": "Визиты в месяц", ...}
+    summary: готовая сводка build_portrait_summary (если нет — строится по df)
     """
-    pivot = df.groupby('portrait_name')[features].mean()
+    if summary is None:
+        summary = build_portrait_summary(df, features)
+    pivot = summary.xs('mean', axis=1, level=1)[features]
     z_text = [[f"{v:.1f}" for v in row] for row in pivot.values]
 
     fig = ff.create_annotated_heatmap(
@@ -34,15 +78,34 @@ def plot_heatmap_features(df: pd.DataFrame, features: list, feature_names: dict)
     return fig
 
 
-def plot_metric(df: pd.DataFrame, metric: str, metric_name: str):
+def plot_metric(df: pd.DataFrame, metric: str, metric_name: str,
+                summary: pd.DataFrame = None):
     """
     Визуализация средней метрики по портретам.
     metric: имя колонки в df
     metric_name: отображаемое русское название
+    summary: готовая сводка build_portrait_summary (если нет — строится по df)
     """
-    summary = df.groupby('portrait_name')[metric].mean().reset_index()
-    summary = summary.rename(
-        columns={'portrait_name': 'Портрет', metric: metric_name})
-    fig = px.bar(summary, x='Портрет', y=metric_name,
+    if summary is None:
+        summary = build_portrait_summary(df, [metric])
+    data = summary[(metric, 'mean')].rename_axis('Портрет').reset_index(
+        name=metric_name)
+    fig = px.bar(data, x='Портрет', y=metric_name,
                  title=f'{metric_name} по портретам')
     return fig
+
+
+def plot_feature_distribution(df: pd.DataFrame, metric: str, metric_name: str,
+                              max_points: int = MAX_POINTS):
+    """
+    Распределение признака внутри портретов (box plot).
+    Данные автоматически сэмплируются до max_points строк.
+    """
+    sample = downsample(df[['portrait_name', metric]], max_points=max_points)
+    sample = sample.rename(
+        columns={'portrait_name': 'Портрет', metric: metric_name})
+    title = f'Распределение: {metric_name}'
+    if len(sample) < len(df):
+        title += f' (выборка {len(sample)} из {len(df)})'
+    fig = px.box(sample, x='Портрет', y=metric_name, title=title)
+    return fig